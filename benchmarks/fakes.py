@@ -0,0 +1,45 @@
+import re
+import zlib
+import numpy as np
+from typing import Any, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.llms import MockLLM
+
+# Local stand-ins for the OpenAI models, so the benchmarks run offline
+
+class FakeEmbedding(BaseEmbedding):
+    """Deterministic bag-of-words embedding built from hashed tokens."""
+
+    dimensions: int = 384
+
+    def __init__(self, dimensions: int = 384, **kwargs: Any):
+        super().__init__(model_name="fake", dimensions=dimensions, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _embed(self, text: str) -> Embedding:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.dimensions] += 1.0 if h & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return [self._embed(text) for text in texts]
+
+def FakeLLM() -> MockLLM:
+    # Echoes a fixed number of prompt tokens back
+    return MockLLM(max_tokens=64)
@@ -0,0 +1,54 @@
+import random
+
+WORDS = (
+    "agreement party clause term payment delivery notice liability warranty "
+    "termination confidential service product license fee invoice period "
+    "obligation breach remedy supplier customer schedule annex section"
+).split()
+
+def make_sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(8, 16))]
+    # Sprinkle clause numbers and product codes for the keyword search
+    if rng.random() < 0.3:
+        words.insert(rng.randint(0, len(words)), f"{rng.randint(1, 20)}.{rng.randint(1, 9)}")
+    if rng.random() < 0.2:
+        words.insert(rng.randint(0, len(words)), f"PX-{rng.randint(100, 999)}")
+    return " ".join(words).capitalize() + "."
+
+def make_pages(pages: int, lines: int = 40, seed: int = 0) -> list[list[str]]:
+    rng = random.Random(seed)
+    return [[make_sentence(rng) for _ in range(lines)] for _ in range(pages)]
+
+def escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path: str, pages: list[list[str]]):
+    # A minimal PDF with one Helvetica text stream per page
+    objects: list[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for page_id, lines in zip(page_ids, pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        )
+        text = "".join(f"({escape(line)}) '\n" for line in lines)
+        stream = f"BT /F1 9 Tf 12 TL 40 760 Td\n{text}ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    with open(path, "wb") as f:
+        f.write(out)
@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import platform
+import statistics
+from typing import Callable
+
+from benchmarks.fakes import FakeEmbedding, FakeLLM
+from benchmarks.pdf import make_pages, write_pdf
+
+from llama_index.core import Settings
+from llama_index.core.schema import NodeWithScore
+
+QUERIES = [
+    "What is the termination notice period?",
+    "Which party is liable for a breach of warranty?",
+    "When is the invoice payment due?",
+    "What does clause 4.2 say about delivery?",
+    "Is the license fee confidential?",
+    "PX-512",
+]
+
+def summarize(samples: list[float]) -> dict:
+    # Latencies in milliseconds
+    samples = sorted(s * 1000 for s in samples)
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max_ms": samples[-1],
+    }
+
+def measure(func: Callable, repeat: int) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def create_documents(count: int, pages: int) -> list[str]:
+    # Synthetic PDFs stored like uploads, by content hash
+    os.makedirs("uploads", exist_ok=True)
+    document_ids = []
+    for i in range(count):
+        path = os.path.join("uploads", f"benchmark-{i}.pdf")
+        write_pdf(path, make_pages(pages, seed=i))
+        with open(path, "rb") as f:
+            document_id = hashlib.sha256(f.read()).hexdigest()
+        os.replace(path, os.path.join("uploads", document_id))
+        document_ids.append(document_id)
+    return document_ids
+
+def bench_ingestion(llama_index, document_ids: list[str], pages: int) -> dict:
+    parser = llama_index.parser
+    parse, split, embed, persist = [], [], [], []
+    chunks = 0
+    for document_id in document_ids:
+        path = os.path.join("uploads", document_id)
+
+        start = time.perf_counter()
+        documents = list(parser.parse_with_markitdown(document_id, path))
+        parse.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        nodes = parser.get_nodes(documents)
+        split.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        parser.embed_nodes(nodes)
+        embed.append(time.perf_counter() - start)
+
+        # Appending to the database, with the BM25 index of the document
+        start = time.perf_counter()
+        llama_index.add_nodes_to_index(nodes)
+        persist.append(time.perf_counter() - start)
+        chunks += len(nodes)
+
+    total = sum(parse) + sum(split) + sum(embed) + sum(persist)
+    start = time.perf_counter()
+    llama_index.compact()
+    compact = time.perf_counter() - start
+
+    return {
+        "documents": len(document_ids),
+        "pages": pages * len(document_ids),
+        "chunks": chunks,
+        "pages_per_second": pages * len(document_ids) / total,
+        "chunks_per_second": chunks / total,
+        "parse": summarize(parse),
+        "split": summarize(split),
+        "embed": summarize(embed),
+        "persist": summarize(persist),
+        "compact_ms": compact * 1000,
+        "database_bytes": os.path.getsize(os.path.join("storage", "index.db")),
+    }
+
+def bench_load(document_ids: list[str], repeat: int) -> dict:
+    from lib.index import LlamaIndex
+
+    # Opening the index, then loading the embeddings of a document
+    def load():
+        llama_index = LlamaIndex()
+        llama_index.index.vector_store.load_partition(document_ids[0])
+
+    return summarize(measure(load, repeat))
+
+def bench_retrieval(llama_index, document_ids: list[str], queries: int, top_k: int) -> dict:
+    from lib.lexical import VECTOR, HYBRID, LEXICAL
+
+    results = {}
+    for mode in (VECTOR, HYBRID, LEXICAL):
+        retrievers = [llama_index.as_retriever(document_id, top_k, mode) for document_id in document_ids]
+        # Warm up the partitions and BM25 indexes
+        for retriever in retrievers:
+            retriever.retrieve(QUERIES[0])
+
+        samples = []
+        for i in range(queries):
+            retriever = retrievers[i % len(retrievers)]
+            query = QUERIES[i % len(QUERIES)]
+            start = time.perf_counter()
+            retriever.retrieve(query)
+            samples.append(time.perf_counter() - start)
+        results[mode] = summarize(samples)
+    return results
+
+def bench_citations(llama_index, document_ids: list[str], queries: int, top_k: int) -> dict:
+    from lib.engines.citated_query_engine import CitatedQueryEngine, CITATION_CHUNKS_KEY
+
+    retriever = llama_index.as_retriever(document_ids[0], top_k)
+    engine = CitatedQueryEngine.from_args(index=None, retriever=retriever, citation_chunk_size=256)
+    nodes = retriever.retrieve(QUERIES[0])
+
+    # Nodes ingested before the sources were precomputed
+    legacy = []
+    for n in nodes:
+        node = n.node.model_copy(deep=True)
+        node.metadata.pop(CITATION_CHUNKS_KEY, None)
+        legacy.append(NodeWithScore(node=node, score=n.score))
+
+    return {
+        "nodes": len(nodes),
+        "sources": len(engine._create_citation_nodes(nodes)),
+        "precomputed": summarize(measure(lambda: engine._create_citation_nodes(nodes), queries)),
+        "split_on_query": summarize(measure(lambda: engine._create_citation_nodes(legacy), queries)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ingestion and query paths")
+    parser.add_argument("--documents", type=int, default=4, help="Number of documents")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per document")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per measurement")
+    parser.add_argument("--loads", type=int, default=5, help="Number of index loads")
+    parser.add_argument("--top-k", type=int, default=3, help="Number of retrieved nodes")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--quantization", default="none", choices=["none", "float16", "int8"], help="Embedding quantization")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    args = parser.parse_args()
+
+    os.environ["VECTOR_QUANTIZATION"] = args.quantization
+
+    # Local models, no network needed
+    Settings.embed_model = FakeEmbedding(dimensions=args.dimensions)
+    Settings.llm = FakeLLM()
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="codex-benchmark-")
+    cwd = os.getcwd()
+
+    # The index uses paths relative to the working directory
+    os.chdir(workdir)
+    try:
+        from lib.index import LlamaIndex
+
+        document_ids = create_documents(args.documents, args.pages)
+        llama_index = LlamaIndex()
+        results = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "ingestion": bench_ingestion(llama_index, document_ids, args.pages),
+            "load": bench_load(document_ids, args.loads),
+            "retrieval": bench_retrieval(llama_index, document_ids, args.queries, args.top_k),
+            "citations": bench_citations(llama_index, document_ids, args.queries, args.top_k),
+        }
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Working directory: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    data = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(data + "\n")
+    print(data)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import time
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+# Default search parameters
+DEFAULT_NPROBE = 8
+DEFAULT_MIN_VECTORS = 2000
+
+# Rows processed at once when assigning vectors to lists
+ASSIGN_BATCH_SIZE = 8192
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-10)
+
+def default_nlist(n: int) -> int:
+    return max(1, int(4 * np.sqrt(n)))
+
+class IVFIndex:
+    """Inverted file index over the rows of an embedding matrix.
+
+    Rows are assigned to the nearest of `nlist` centroids. A search only
+    scores the rows in the `nprobe` lists closest to the query, so `nprobe`
+    trades recall for latency.
+    """
+
+    def __init__(self, centroids: np.ndarray, lists: np.ndarray, nprobe: int = DEFAULT_NPROBE):
+        self.centroids = centroids
+        self.lists = lists
+        self.nprobe = nprobe
+
+        # Group the rows by list
+        self.order = np.argsort(lists, kind="stable")
+        self.offsets = np.searchsorted(lists[self.order], np.arange(len(centroids) + 1))
+
+    @classmethod
+    def train(cls, matrix: np.ndarray, nlist: int = 0, nprobe: int = DEFAULT_NPROBE, iterations: int = 10, seed: int = 0) -> "IVFIndex":
+        # Spherical k-means on a sample of the rows
+        n = len(matrix)
+        nlist = min(nlist or default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        sample = normalize(matrix[rng.choice(n, size=min(n, 256 * nlist), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+
+        for _ in range(iterations):
+            assignments = assign(centroids, sample)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            # Keep the old centroid for empty lists
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+
+        return cls(centroids, assign(centroids, normalize(matrix)), nprobe)
+
+    def probe(self, query: np.ndarray) -> np.ndarray:
+        # Rows in the lists closest to the query
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+    def search(self, matrix: np.ndarray, norms: np.ndarray, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        rows = self.probe(query)
+
+        # Score only the rows in those lists
+        similarities = matrix[rows] @ query / norms[rows]
+        k = min(k, len(rows))
+        if k == 0:
+            return rows[:0], similarities[:0]
+        top = np.argpartition(-similarities, k - 1)[:k]
+        return rows[top], similarities[top]
+
+    def save(self, path: str, ids: list[str]):
+        # Write to a temporary file and move it in place atomically
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                lists=self.lists,
+                ids=np.array(ids),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, ids: list[str], nprobe: int = DEFAULT_NPROBE) -> Optional["IVFIndex"]:
+        if not os.path.exists(path):
+            return None
+
+        # The index is only valid for the rows it was trained on
+        data = np.load(path)
+        if data["ids"].tolist() != ids:
+            return None
+        return cls(data["centroids"], data["lists"], nprobe)
+
+def assign(centroids: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    # Nearest centroid of each row, in batches to bound memory
+    lists = np.empty(len(matrix), dtype=np.int64)
+    for i in range(0, len(matrix), ASSIGN_BATCH_SIZE):
+        lists[i:i + ASSIGN_BATCH_SIZE] = np.argmax(matrix[i:i + ASSIGN_BATCH_SIZE] @ centroids.T, axis=1)
+    return lists
+
+# Benchmark recall against exact search
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="IVF recall benchmark")
+    parser.add_argument("-n", type=int, default=50000, help="Number of vectors")
+    parser.add_argument("-d", type=int, default=256, help="Dimensions")
+    parser.add_argument("-k", type=int, default=10, help="Top k")
+    parser.add_argument("-q", type=int, default=200, help="Number of queries")
+    parser.add_argument("--nlist", type=int, default=0, help="Number of lists")
+    args = parser.parse_args()
+
+    # Clustered synthetic data
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(100, args.d)).astype(np.float32)
+    matrix = (centers[rng.integers(0, 100, args.n)] + 0.5 * rng.normal(size=(args.n, args.d))).astype(np.float32)
+    queries = normalize(matrix[rng.choice(args.n, args.q)] + 0.1 * rng.normal(size=(args.q, args.d)).astype(np.float32))
+    norms = np.maximum(np.linalg.norm(matrix, axis=1), 1e-10)
+
+    start = time.perf_counter()
+    index = IVFIndex.train(matrix, args.nlist)
+    print(f"Trained {len(index.centroids)} lists in {time.perf_counter() - start:.2f}s")
+
+    # Exact results
+    start = time.perf_counter()
+    exact = [set(np.argpartition(-(matrix @ q / norms), args.k - 1)[:args.k]) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / args.q
+    print(f"exact: {exact_ms:.3f}ms/query")
+
+    for nprobe in (1, 2, 4, 8, 16, 32, 64):
+        index.nprobe = nprobe
+        start = time.perf_counter()
+        results = [set(index.search(matrix, norms, q, args.k)[0]) for q in queries]
+        ms = (time.perf_counter() - start) * 1000 / args.q
+        recall = np.mean([len(r & e) / args.k for r, e in zip(results, exact)])
+        print(f"nprobe={nprobe}: recall@{args.k}={recall:.3f} {ms:.3f}ms/query")
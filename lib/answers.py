@@ -0,0 +1,100 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+# Default cache settings
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_SIZE = 256
+
+def normalize(question: str) -> str:
+    # Transcripts of the same question differ in case and punctuation
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+@dataclass
+class CachedAnswer:
+    question: str
+    embedding: Optional[np.ndarray]
+    answer: str
+    sources: list[str]
+    created_at: float = field(default_factory=time.time)
+
+class AnswerCache:
+    """Per-document cache of answers, matched by question embedding similarity.
+
+    Without embeddings, answers are only matched to the same normalized question.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, ttl: int = DEFAULT_TTL, size: int = DEFAULT_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.documents: dict[str, OrderedDict[str, CachedAnswer]] = dict()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, document_id: str, question: str, embedding: Optional[list[float]] = None) -> Optional[CachedAnswer]:
+        now = time.time()
+
+        with self.lock:
+            entries = self.documents.get(document_id, OrderedDict())
+
+            # Drop the expired answers
+            for key in [k for k, v in entries.items() if now - v.created_at > self.ttl]:
+                del entries[key]
+
+            best: Optional[CachedAnswer] = entries.get(normalize(question))
+            candidates = [entry for entry in entries.values() if entry.embedding is not None]
+            if best is None and embedding is not None and candidates:
+                q = np.asarray(embedding, dtype=np.float32)
+                q = q / max(float(np.linalg.norm(q)), 1e-10)
+                similarities = np.stack([entry.embedding for entry in candidates]) @ q
+                i = int(np.argmax(similarities))
+                if similarities[i] >= self.threshold:
+                    best = candidates[i]
+            if best:
+                entries.move_to_end(normalize(best.question))
+
+            if best:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return best
+
+    def store(self, document_id: str, question: str, embedding: Optional[list[float]], answer: str, sources: list[str]):
+        e = None
+        if embedding is not None:
+            e = np.asarray(embedding, dtype=np.float32)
+            e = e / max(float(np.linalg.norm(e)), 1e-10)
+
+        key = normalize(question)
+        with self.lock:
+            entries = self.documents.setdefault(document_id, OrderedDict())
+            entries[key] = CachedAnswer(question, e, answer, sources)
+            entries.move_to_end(key)
+
+            # Evict the least recently used answers
+            while len(entries) > self.size:
+                entries.popitem(last=False)
+
+    def invalidate(self, document_id: str):
+        with self.lock:
+            self.documents.pop(document_id, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": sum(len(entries) for entries in self.documents.values()),
+            }
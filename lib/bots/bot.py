@@ -1,3 +1,4 @@
+import asyncio
 from typing import Optional, List
 from lib.helpers import get_env
 from lib.models import Environment
@@ -18,7 +19,7 @@ from pipecat.services.deepgram import DeepgramSTTService
 from pipecat.services.elevenlabs import ElevenLabsTTSService
 
 # Processor
-from lib.text_filters import CitationFilter
+from lib.text_filters import CitationFilter, CitationFilterProcessor
 from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContext
 from pipecat.processors.transcript_processor import TranscriptProcessor
 from pipecat.processors.frameworks.rtvi import (
@@ -27,6 +28,11 @@ from pipecat.processors.frameworks.rtvi import (
     RTVIBotTTSProcessor
 )
 from lib.services.llama_index import LlamaIndexService
+from lib.speculation import SpeculativeRetrievalProcessor
+from lib.metrics import TurnTimer
+from lib.services.retrieval import RetrievalClient
+from pipecat.observers.base_observer import BaseObserver
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
 
 # Filters
 from pipecat.processors.filters.stt_mute_filter import (
@@ -37,7 +43,9 @@ from pipecat.processors.filters.stt_mute_filter import (
 
 # All frames
 from pipecat.frames.frames import (
-    TranscriptionMessage, TranscriptionUpdateFrame
+    Frame, TranscriptionMessage, TranscriptionUpdateFrame,
+    UserStartedSpeakingFrame, UserStoppedSpeakingFrame, TranscriptionFrame,
+    TTSAudioRawFrame, BotStoppedSpeakingFrame
 )
 
 class TranscriptHandler:
@@ -52,11 +60,55 @@ class TranscriptHandler:
     async def handle_message(self, message: TranscriptionMessage):
         print(f"Transcript: {message.role}: {message.content}")
 
+class TurnMetricsObserver(BaseObserver):
+    def __init__(self, timer: TurnTimer, client: RetrievalClient):
+        self.timer = timer
+        self.client = client
+        self.tasks: set[asyncio.Task] = set()
+
+        # Frames are seen once per hop through the pipeline
+        self.last_start: Optional[int] = None
+
+    async def on_push_frame(
+        self,
+        src: FrameProcessor,
+        dst: FrameProcessor,
+        frame: Frame,
+        direction: FrameDirection,
+        timestamp: int,
+    ):
+        # The LLM service marks the retrieval and the first token itself
+        if isinstance(frame, UserStartedSpeakingFrame) and frame.id != self.last_start:
+            # A new turn starts when the user speaks, so that the transcription
+            # of the turn is kept even when it arrives before the end of speech
+            self.last_start = frame.id
+            self.timer.reset()
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self.timer.mark("vad_end")
+        elif isinstance(frame, TranscriptionFrame):
+            self.timer.mark("stt_final")
+        elif isinstance(frame, TTSAudioRawFrame):
+            self.timer.mark("first_audio")
+        elif isinstance(frame, BotStoppedSpeakingFrame) and "first_audio" in self.timer.marks:
+            self.timer.mark("audio_end")
+            await self.report()
+
+    async def report(self):
+        durations = self.timer.durations()
+        tokens = self.timer.tokens
+        self.timer.reset()
+
+        # Send the timings to the server without holding up the pipeline
+        task = asyncio.create_task(self.client.request("observe_turn", durations=durations, tokens=tokens))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
 class Bot:
-    def __init__(self, url, token, document_id):
+    def __init__(self, url, token, document_id, vad_analyzer: Optional[SileroVADAnalyzer] = None):
         self.url = url
         self.token = token
         self.document_id = document_id
+        self.vad_analyzer = vad_analyzer
         self.env: Environment = get_env()
 
         # Variables
@@ -70,6 +122,9 @@ class Bot:
             )
         )
 
+        # Flush the filter at the end of each response
+        self.citation_filter = CitationFilterProcessor(text_filter)
+
         # Configure services
         self.stt = DeepgramSTTService(
             api_key=self.env["DEEPGRAM_API_KEY"]
@@ -85,10 +140,15 @@ class Bot:
             )
         )
 
+        self.timer = TurnTimer()
         self.llm = LlamaIndexService(
-            document_id=self.document_id
+            document_id=self.document_id,
+            timer=self.timer,
         )
 
+        # Start retrieval while the user is still speaking
+        self.speculative_retrieval = SpeculativeRetrievalProcessor(self.llm)
+
         # Aggregator
         context = OpenAILLMContext(
             messages=[{
@@ -120,7 +180,7 @@ class Bot:
             params=DailyParams(
                 audio_out_enabled=True,
                 vad_enabled=True,
-                vad_analyzer=SileroVADAnalyzer(),
+                vad_analyzer=self.vad_analyzer or SileroVADAnalyzer(),
                 vad_audio_passthrough=True,
             )
         )
@@ -155,10 +215,12 @@ class Bot:
             self.stt_mute_filter,
             self.rtvi_speaking,
             self.stt,
+            self.speculative_retrieval,
             self.rtvi_user_transcription,
             self.context_aggregator.user(),
             self.llm,
             self.rtvi_bot_transcription,
+            self.citation_filter,
             self.tts,
             self.transport.output(),
             self.context_aggregator.assistant(),
@@ -168,7 +230,12 @@ class Bot:
             pipeline,
             PipelineParams(
                 allow_interruptions=True,
-                observers=[self.rtvi.observer()],
+                enable_metrics=True,
+                enable_usage_metrics=True,
+                observers=[
+                    self.rtvi.observer(),
+                    TurnMetricsObserver(self.timer, self.llm.client),
+                ],
             )
         )
         self.runner = PipelineRunner()
@@ -2,6 +2,12 @@ import asyncio
 import argparse
 from .bot import Bot
 
+async def run_bot(url, token, document_id, vad_analyzer=None):
+    bot = Bot(url, token, document_id, vad_analyzer=vad_analyzer)
+    await bot.create_transport()
+    await bot.create_pipeline()
+    await bot.start()
+
 async def main():
     parser = argparse.ArgumentParser(description="Codex")
     parser.add_argument("-u", "--url", type=str, help="Room URL", required=True)
@@ -9,10 +15,7 @@ async def main():
     parser.add_argument("-d", "--document", type=str, help="Document ID", required=True)
 
     args = parser.parse_args()
-    bot = Bot(args.url, args.token, args.document)
-    await bot.create_transport()
-    await bot.create_pipeline()
-    await bot.start()
+    await run_bot(args.url, args.token, args.document)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import time
+import asyncio
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import Connection, wait
+from multiprocessing.process import BaseProcess
+
+# Seconds to wait for processes to exit before killing them
+DEFAULT_SHUTDOWN_TIMEOUT = 5.0
+
+def stop_processes(processes: list[BaseProcess], timeout: float = DEFAULT_SHUTDOWN_TIMEOUT):
+    # Signal all the processes first, so that they exit in parallel
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+    deadline = time.monotonic() + timeout
+    pending = [p for p in processes if p.is_alive()]
+    while pending and (remaining := deadline - time.monotonic()) > 0:
+        wait([p.sentinel for p in pending], timeout=remaining)
+        pending = [p for p in pending if p.is_alive()]
+
+    # Kill the ones that didn't exit in time
+    for process in pending:
+        process.kill()
+    for process in processes:
+        process.join()
+
+def worker_main(conn: Connection):
+    # Pay the imports and the model loading before a call comes in
+    from lib.bots.default import run_bot
+    from pipecat.audio.vad.silero import SileroVADAnalyzer
+    vad_analyzer = SileroVADAnalyzer()
+    conn.send("ready")
+
+    # Wait for a room to join
+    try:
+        url, token, document_id = conn.recv()
+    except EOFError:
+        return
+    conn.close()
+    asyncio.run(run_bot(url, token, document_id, vad_analyzer=vad_analyzer))
+
+class BotPool:
+    """Keeps a number of warm bot workers that are ready to join a room."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.context = multiprocessing.get_context("spawn")
+        self.idle: deque[tuple[BaseProcess, Connection]] = deque()
+
+    def spawn(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(target=worker_main, args=(child_conn,))
+        process.start()
+        child_conn.close()
+        self.idle.append((process, parent_conn))
+
+    def start(self):
+        for _ in range(self.size):
+            self.spawn()
+
+    def take(self) -> tuple[BaseProcess, Connection]:
+        # Drop the workers that died while waiting
+        workers = [(p, c) for p, c in self.idle if p.is_alive()]
+        self.idle = deque(workers)
+        if not self.idle:
+            self.spawn()
+
+        # Prefer a worker that finished warming up
+        for worker in self.idle:
+            if worker[1].poll():
+                self.idle.remove(worker)
+                return worker
+        return self.idle.popleft()
+
+    async def launch(self, url: str, token: str, document_id: str) -> BaseProcess:
+        process, conn = self.take()
+        conn.send((url, token, document_id))
+        conn.close()
+
+        # Replace the used worker after responding
+        asyncio.get_running_loop().call_soon(self.refill)
+        return process
+
+    def refill(self):
+        while len(self.idle) < self.size:
+            self.spawn()
+
+    def drain(self) -> list[BaseProcess]:
+        # Hand the idle workers over to be stopped, closing their end of the pipe
+        processes = []
+        for process, conn in self.idle:
+            conn.close()
+            processes.append(process)
+        self.idle.clear()
+        return processes
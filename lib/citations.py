@@ -0,0 +1,45 @@
+import re
+
+# Citation markers like [1] or [1, 2]
+CITATION_PATTERN = re.compile(r"\[(\d+(?:\s*,\s*\d+)*)\]")
+
+# The start of a marker that may be completed by the next chunk
+PARTIAL_PATTERN = re.compile(r"\[[\d\s,]*$")
+
+# Longest partial marker held back before giving up on it
+MAX_PENDING = 32
+
+class CitationParser:
+    """Incrementally finds and strips citation markers in streamed text."""
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, text: str) -> tuple[str, list[int]]:
+        # Only the held back partial marker is scanned again
+        buffer = self.pending + text
+        self.pending = ""
+
+        parts: list[str] = []
+        citations: list[int] = []
+        position = 0
+        for match in CITATION_PATTERN.finditer(buffer):
+            parts.append(buffer[position:match.start()])
+            citations.extend(int(n) for n in match.group(1).split(","))
+            position = match.end()
+
+        # Hold back a marker that is split across chunks
+        rest = buffer[position:]
+        partial = PARTIAL_PATTERN.search(rest)
+        if partial and len(rest) - partial.start() <= MAX_PENDING:
+            self.pending = rest[partial.start():]
+            rest = rest[:partial.start()]
+        parts.append(rest)
+        return "".join(parts), citations
+
+    def flush(self) -> str:
+        pending, self.pending = self.pending, ""
+        return pending
+
+    def reset(self):
+        self.pending = ""
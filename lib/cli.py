@@ -0,0 +1,74 @@
+import os
+import shutil
+import asyncio
+import argparse
+import lib.helpers as helpers
+
+# Commands that need the index and the database
+INDEX_COMMANDS = ["reindex", "compact", "verify"]
+
+def reset():
+    # The database runs in WAL mode, so its log files go with it
+    for path in ["codex.db", "codex.db-wal", "codex.db-shm"]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    shutil.rmtree("uploads", ignore_errors=True)
+    shutil.rmtree("storage", ignore_errors=True)
+
+async def run_command(command: str):
+    # Only build what the commands need, not the whole server
+    from lib import maintenance
+    from lib.database import Database, DEFAULT_POOL_SIZE
+    from lib.embeddings import use_embedding_cache, DEFAULT_CACHE_SIZE
+    from lib.index import LlamaIndex
+    from lib.ingestion import IngestionQueue
+
+    database = Database(pool_size=helpers.get_int("DATABASE_POOL_SIZE", DEFAULT_POOL_SIZE))
+    use_embedding_cache(max_size=helpers.get_int("EMBEDDING_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    llama_index = LlamaIndex()
+
+    await database.start()
+    try:
+        match command:
+            case "reindex":
+                print("Reindexing...")
+                ingestion = IngestionQueue(
+                    database,
+                    llama_index,
+                    workers=helpers.get_int("INGESTION_WORKERS", os.cpu_count() or 1),
+                )
+                print(await maintenance.reindex(database, llama_index, ingestion))
+            case "compact":
+                print("Compacting...")
+                print(await maintenance.compact(database, llama_index))
+            case "verify":
+                print("Verifying...")
+                problems = await maintenance.verify(database, llama_index)
+                for problem in problems:
+                    print(problem)
+                if problems:
+                    raise SystemExit(1)
+    finally:
+        await database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Codex CLI")
+    parser.add_argument("command", type=str, help="The command to run", choices=["reset", *INDEX_COMMANDS])
+    args = parser.parse_args()
+
+    helpers.set_env()
+
+    # Handle args
+    match args.command:
+        case "reset":
+            print("Resetting...")
+            reset()
+        case _:
+            asyncio.run(run_command(args.command))
+    print("Done!")
+
+# The ingestion workers import this module again, so nothing runs on import
+if __name__ == "__main__":
+    main()
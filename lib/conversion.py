@@ -0,0 +1,49 @@
+import os
+import tempfile
+from typing import Optional
+
+from pdfminer.high_level import extract_text
+from pdfminer.pdfpage import PDFPage
+
+# Page separator in the converted text
+PAGE_BREAK = "\f"
+
+# Converted documents, keyed by the sha256 of the upload
+MARKDOWN_DIR = os.path.join("cache", "markdown")
+
+# Pages converted by a worker at once
+PAGES_PER_RANGE = 16
+
+def get_markdown_path(document_id: str) -> str:
+    return os.path.join(MARKDOWN_DIR, f"{document_id}.md")
+
+def load_markdown(document_id: str) -> Optional[str]:
+    path = get_markdown_path(document_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def save_markdown(document_id: str, text: str):
+    # Write to a temporary file and move it in place atomically
+    os.makedirs(MARKDOWN_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=MARKDOWN_DIR, suffix=".md")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, get_markdown_path(document_id))
+
+def is_pdf(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(5) == b"%PDF-"
+
+def count_pages(path: str) -> int:
+    with open(path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+def get_page_ranges(pages: int, size: int = PAGES_PER_RANGE) -> list[tuple[int, int]]:
+    return [(start, min(start + size, pages)) for start in range(0, pages, size)]
+
+def convert_pages(path: str, start: int, end: int) -> list[str]:
+    # Same conversion as MarkItDown, which ends each page with a form feed
+    text = extract_text(path, page_numbers=range(start, end))
+    return text.split(PAGE_BREAK)[:end - start]
@@ -0,0 +1,114 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlmodel import SQLModel, create_engine as create_sync_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from lib.models import sqlite_url, async_sqlite_url, connect_args
+
+# Applied to every new connection
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "foreign_keys": "ON",
+    "cache_size": -16000,
+    "temp_store": "MEMORY",
+}
+
+DEFAULT_POOL_SIZE = 5
+
+# Maximum number of writes committed in one transaction
+WRITE_BATCH_SIZE = 64
+
+Write = Callable[[AsyncSession], Awaitable[Any]]
+
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for key, value in PRAGMAS.items():
+        cursor.execute(f"PRAGMA {key}={value}")
+    cursor.close()
+
+def create_engine() -> Engine:
+    # Blocking engine for the ingestion workers
+    engine = create_sync_engine(sqlite_url, connect_args=connect_args)
+    event.listen(engine, "connect", set_pragmas)
+    return engine
+
+class Database:
+    """Async engine of the API, with the writes batched into shared transactions.
+
+    Reads use their own pooled sessions. Writes are queued and committed
+    by a single task, so concurrent requests don't wait on each other for
+    the database lock.
+    """
+
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE):
+        self.engine: AsyncEngine = create_async_engine(
+            async_sqlite_url,
+            pool_size=pool_size,
+            max_overflow=pool_size,
+        )
+        event.listen(self.engine.sync_engine, "connect", set_pragmas)
+
+        self.writes: asyncio.Queue[tuple[Write, asyncio.Future]] = asyncio.Queue()
+        self.writer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        self.writer = asyncio.create_task(self.write_batches())
+
+    async def close(self):
+        # Let the queued writes finish
+        await self.writes.join()
+        if self.writer:
+            self.writer.cancel()
+        await self.engine.dispose()
+
+    def session(self) -> AsyncSession:
+        return AsyncSession(self.engine, expire_on_commit=False)
+
+    async def write(self, func: Write) -> Any:
+        # Resolves once the transaction of the batch is committed
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((func, future))
+        return await future
+
+    async def write_batches(self):
+        while True:
+            # Take everything that queued up while the last batch was committed
+            batch = [await self.writes.get()]
+            while len(batch) < WRITE_BATCH_SIZE and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+
+            try:
+                await self.commit(batch)
+            except Exception:
+                # Find the failing writes by committing each on its own
+                for write in batch:
+                    try:
+                        await self.commit([write])
+                    except Exception as e:
+                        if not write[1].done():
+                            write[1].set_exception(e)
+            except asyncio.CancelledError:
+                for _, future in batch:
+                    future.cancel()
+                raise
+            finally:
+                for _ in batch:
+                    self.writes.task_done()
+
+    async def commit(self, batch: list[tuple[Write, asyncio.Future]]):
+        results = []
+        async with self.session() as session:
+            for func, _ in batch:
+                results.append(await func(session))
+            await session.commit()
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,210 @@
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from hashlib import sha256
+from typing import Any, Optional
+
+from pydantic import PrivateAttr
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+
+DEFAULT_CACHE_PATH = os.path.join("cache", "embeddings.db")
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# Seconds between writes of the access times of the hits
+ACCESS_FLUSH_INTERVAL = 60
+
+class EmbeddingCache:
+    """Content-addressed embedding cache stored in SQLite."""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_size: int = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        # Several processes share the cache file
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)")
+
+        # Total size of the vectors, kept up to date by triggers so we never sum the table
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "INSERT OR IGNORE INTO cache_size (id, size) "
+            "SELECT 0, COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        )
+        self.conn.executescript("""
+            CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings BEGIN
+                UPDATE cache_size SET size = size + LENGTH(NEW.vector) WHERE id = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_update AFTER UPDATE OF vector ON embeddings BEGIN
+                UPDATE cache_size SET size = size + LENGTH(NEW.vector) - LENGTH(OLD.vector) WHERE id = 0;
+            END;
+            CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings BEGIN
+                UPDATE cache_size SET size = size - LENGTH(OLD.vector) WHERE id = 0;
+            END;
+        """)
+        self.conn.commit()
+
+        # Access times of the hits, written in batches
+        self.accessed: dict[str, float] = {}
+        self.flushed_at = time.time()
+
+    @staticmethod
+    def make_key(identity: str, text: str) -> str:
+        return sha256(f"{identity}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, Embedding]:
+        if not keys:
+            return {}
+
+        with self.lock:
+            found: dict[str, Embedding] = {}
+            # Stay below the SQLite variable limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, vector in rows:
+                    found[key] = array("f", vector).tolist()
+
+            # Mark the hits as recently used, without a write on every lookup
+            now = time.time()
+            self.accessed.update((key, now) for key in found)
+            if self.accessed and now - self.flushed_at > ACCESS_FLUSH_INTERVAL:
+                self.flush()
+                self.conn.commit()
+        return found
+
+    def flush(self):
+        if self.accessed:
+            self.conn.executemany(
+                "UPDATE embeddings SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self.accessed.items()]
+            )
+            self.accessed.clear()
+        self.flushed_at = time.time()
+
+    def put_many(self, items: dict[str, Embedding]):
+        if not items:
+            return
+
+        now = time.time()
+        with self.lock:
+            # Upsert rather than replace, so the triggers see the old vector
+            self.conn.executemany(
+                "INSERT INTO embeddings (key, vector, accessed) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET vector = excluded.vector, accessed = excluded.accessed",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            if self.size() > self.max_size:
+                self.flush()
+                self.evict()
+            self.conn.commit()
+
+    def size(self) -> int:
+        return self.conn.execute("SELECT size FROM cache_size WHERE id = 0").fetchone()[0]
+
+    def evict(self):
+        # Drop the least recently used entries until we fit
+        while self.size() > self.max_size:
+            keys = self.conn.execute(
+                "SELECT key FROM embeddings ORDER BY accessed LIMIT 1000"
+            ).fetchall()
+            if not keys:
+                break
+            self.conn.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+
+class CachedEmbedding(BaseEmbedding):
+    """Embedding model that checks the embedding cache first."""
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+    _identity: str = PrivateAttr()
+
+    def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=embed_model.embed_batch_size,
+            **kwargs
+        )
+        self._embed_model = embed_model
+        self._cache = cache
+
+        # Embeddings are only valid for the model that created them
+        dimensions = getattr(embed_model, "dimensions", None)
+        self._identity = f"{embed_model.class_name()}:{embed_model.model_name}:{dimensions}"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _split(self, kind: str, texts: list[str]) -> tuple[list[str], dict[str, Embedding], list[str]]:
+        keys = [EmbeddingCache.make_key(f"{self._identity}:{kind}", text) for text in texts]
+        found = self._cache.get_many(list(set(keys)))
+
+        # Only embed each missing text once
+        missing = list({key: text for key, text in zip(keys, texts) if key not in found}.items())
+        return keys, found, missing
+
+    def _merge(self, keys, found, missing, embeddings: list[Embedding]) -> list[Embedding]:
+        new = {key: embedding for (key, _), embedding in zip(missing, embeddings)}
+        self._cache.put_many(new)
+        found.update(new)
+        return [found[key] for key in keys]
+
+    def _embed(self, kind: str, texts: list[str]) -> list[Embedding]:
+        keys, found, missing = self._split(kind, texts)
+        if not missing:
+            return [found[key] for key in keys]
+        if kind == "query":
+            embeddings = [self._embed_model._get_query_embedding(text) for _, text in missing]
+        else:
+            embeddings = self._embed_model._get_text_embeddings([text for _, text in missing])
+        return self._merge(keys, found, missing, embeddings)
+
+    async def _aembed(self, kind: str, texts: list[str]) -> list[Embedding]:
+        keys, found, missing = self._split(kind, texts)
+        if not missing:
+            return [found[key] for key in keys]
+        if kind == "query":
+            embeddings = [await self._embed_model._aget_query_embedding(text) for _, text in missing]
+        else:
+            embeddings = await self._embed_model._aget_text_embeddings([text for _, text in missing])
+        return self._merge(keys, found, missing, embeddings)
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._embed("query", [query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await self._aembed("query", [query]))[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._embed("text", [text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aembed("text", [text]))[0]
+
+    def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return self._embed("text", texts)
+
+    async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+        return await self._aembed("text", texts)
+
+def use_embedding_cache(path: str = DEFAULT_CACHE_PATH, max_size: Optional[int] = None):
+    # Wrap the configured embedding model with the cache
+    if isinstance(Settings.embed_model, CachedEmbedding):
+        return
+    cache = EmbeddingCache(path, max_size or DEFAULT_CACHE_SIZE)
+    Settings.embed_model = CachedEmbedding(Settings.embed_model, cache)
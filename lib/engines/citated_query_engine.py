@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Any, List, Optional, Sequence
+from typing import Any, List, Optional, Sequence, Type
 
 from llama_index.core.base.base_query_engine import BaseQueryEngine
 from llama_index.core.base.base_retriever import BaseRetriever
@@ -62,6 +62,10 @@ CITATION_QA_TEMPLATE = PromptTemplate(
 DEFAULT_CITATION_CHUNK_SIZE = 512
 DEFAULT_CITATION_CHUNK_OVERLAP = 20
 
+# Metadata of the precomputed sources and of the nodes created from them
+CITATION_CHUNKS_KEY = "citation_chunks"
+CITATION_OF_KEY = "citation_of"
+
 class CitatedAnswer(BaseModel):
     answer: str
     citations: List[int]
@@ -115,6 +119,7 @@ class CitatedQueryEngine(BaseQueryEngine):
         response_mode: ResponseMode = ResponseMode.COMPACT,
         use_async: bool = False,
         streaming: bool = False,
+        output_cls: Optional[Type[BaseModel]] = CitatedAnswer,
         # class-specific args
         metadata_mode: MetadataMode = MetadataMode.NONE,
         **kwargs: Any,
@@ -127,7 +132,7 @@ class CitatedQueryEngine(BaseQueryEngine):
             response_mode=response_mode,
             use_async=use_async,
             streaming=streaming,
-            output_cls=CitatedAnswer,
+            output_cls=output_cls,
         )
 
         return cls(
@@ -148,20 +153,39 @@ class CitatedQueryEngine(BaseQueryEngine):
 
     def _create_citation_nodes(self, nodes: List[NodeWithScore]) -> List[NodeWithScore]:
         """Modify retrieved nodes to be granular sources."""
+        # Nodes that are already sources are left alone
+        if nodes and all(CITATION_OF_KEY in node.node.metadata for node in nodes):
+            return nodes
+
         new_nodes: List[NodeWithScore] = []
         for node in nodes:
-            text_chunks = self.text_splitter.split_text(
-                node.node.get_content(metadata_mode=self._metadata_mode)
-            )
+            # Sources are split at ingestion, older nodes are split here
+            text_chunks = node.node.metadata.get(CITATION_CHUNKS_KEY)
+            if text_chunks is None:
+                text_chunks = self.text_splitter.split_text(
+                    node.node.get_content(metadata_mode=self._metadata_mode)
+                )
 
-            for text_chunk in text_chunks:
+            metadata = {
+                key: value for key, value in node.node.metadata.items()
+                if key != CITATION_CHUNKS_KEY
+            }
+            # Hide the same metadata as the parent, and the parent ID too
+            excluded_llm_metadata_keys = [*node.node.excluded_llm_metadata_keys, CITATION_OF_KEY]
+            excluded_embed_metadata_keys = [*node.node.excluded_embed_metadata_keys, CITATION_OF_KEY]
+            for i, text_chunk in enumerate(text_chunks):
                 text = f"Source {len(new_nodes) + 1}:\n{text_chunk}\n"
 
                 new_node = NodeWithScore(
-                    node=TextNode.model_validate(node.node.model_dump()),
+                    node=TextNode(
+                        id_=f"{node.node.node_id}-c{i}",
+                        text=text,
+                        metadata={**metadata, CITATION_OF_KEY: node.node.node_id},
+                        excluded_llm_metadata_keys=excluded_llm_metadata_keys,
+                        excluded_embed_metadata_keys=excluded_embed_metadata_keys,
+                    ),
                     score=node.score,
                 )
-                new_node.node.set_content(text)
                 new_nodes.append(new_node)
         return new_nodes
 
@@ -0,0 +1,63 @@
+import time
+import uuid
+import argparse
+from aiohttp import web
+
+# A local stand-in for the parts of the Daily REST API we use
+class FakeDaily:
+    def __init__(self, domain: str = "fake.daily.co"):
+        self.domain = domain
+        self.rooms: dict[str, dict] = dict()
+        self.tokens: dict[str, dict] = dict()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/rooms", self.create_room),
+            web.get("/rooms/{name}", self.get_room),
+            web.delete("/rooms/{name}", self.delete_room),
+            web.post("/meeting-tokens", self.create_token),
+        ])
+        return app
+
+    async def create_room(self, request: web.Request) -> web.Response:
+        body = await request.json() if request.can_read_body else {}
+        name = body.get("name") or uuid.uuid4().hex[:12]
+        room = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "api_created": True,
+            "privacy": body.get("privacy", "public"),
+            "url": f"https://{self.domain}/{name}",
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "config": body.get("properties", {}),
+        }
+        self.rooms[name] = room
+        return web.json_response(room)
+
+    async def get_room(self, request: web.Request) -> web.Response:
+        room = self.rooms.get(request.match_info["name"])
+        if not room:
+            return web.json_response({"error": "not-found"}, status=404)
+        return web.json_response(room)
+
+    async def delete_room(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        if not self.rooms.pop(name, None):
+            return web.json_response({"error": "not-found"}, status=404)
+        return web.json_response({"deleted": True, "name": name})
+
+    async def create_token(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        properties = body.get("properties", {})
+        if properties.get("room_name") not in self.rooms:
+            return web.json_response({"error": "invalid-request-error"}, status=400)
+        token = uuid.uuid4().hex
+        self.tokens[token] = properties
+        return web.json_response({"token": token})
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Daily REST API")
+    parser.add_argument("-p", "--port", type=int, default=9000, help="Port to listen on")
+    args = parser.parse_args()
+    web.run_app(FakeDaily().create_app(), port=args.port)
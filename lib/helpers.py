@@ -13,7 +13,7 @@ def set_env():
 
     # Add them as environment variables
     for key, value in config.items():
-        os.environ[key] = value
+        os.environ[key] = str(value)
 
 def get_env() -> Environment:
     # Read the config file
@@ -22,7 +22,10 @@ def get_env() -> Environment:
 
     return config
 
-def save_file(path: str, content: bytes):
-    # First, save the file
-    with open(path, "wb") as f:
-        _ = f.write(content)
\ No newline at end of file
+def get_int(key: str, default: int) -> int:
+    # Read an optional integer setting from the environment
+    return int(os.environ.get(key, default))
+
+def get_float(key: str, default: float) -> float:
+    # Read an optional float setting from the environment
+    return float(os.environ.get(key, default))
@@ -1,46 +1,44 @@
 import os
-from typing import Optional
-from markitdown import MarkItDown
+import traceback
+from typing import Callable, Optional
+from lib.parser import DocumentParser
+from lib.storage import load_index
+from lib.lexical import LexicalStore, HybridRetriever, VECTOR
 
 from llama_index.core.indices.base import BaseIndex
-from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import BaseNode
 from llama_index.core.query_engine import BaseQueryEngine
 from llama_index.core.chat_engine import CondenseQuestionChatEngine
-from llama_index.core import (
-    VectorStoreIndex, Document,
-    StorageContext, load_index_from_storage,
-)
+from llama_index.core import VectorStoreIndex
 from llama_index.core.vector_stores import (
     MetadataFilter,
     MetadataFilters
 )
 
 class LlamaIndex:
-    def __init__(self):
-        # Create a markdown parser
-        self.md = MarkItDown()
-
-        # Parser
-        self.parser = SentenceSplitter()
+    def __init__(self, parser: Optional[DocumentParser] = None):
+        # Document parser
+        self.parser = parser or DocumentParser()
 
         # Create index
         self.index: Optional[BaseIndex] = None
         self.query_engine: Optional[BaseQueryEngine] = None
         self.chat_engine: Optional[CondenseQuestionChatEngine] = None
 
-        # Create storage context
-        self.storage_context = None
+        # Called with the ID of each document whose nodes changed
+        self.listeners: list[Callable[[str], None]] = []
 
-        # Check if we have persisted storage
-        if not os.path.exists("storage"):
-            self.create_index()
-            return
+        # Load the index from storage, or create it
+        self.lexical: Optional[LexicalStore] = None
+        self.load()
 
-        # Load the index from storage
-        self.index = load_index_from_storage(
-            StorageContext.from_defaults(persist_dir="storage"),
-            index_id="vector_index"
-        )
+    def load(self):
+        self.index = load_index()
+        self.storage_context = self.index.storage_context
+
+        # BM25 indexes live in the same database
+        self.lexical = LexicalStore(self.index.vector_store.client)
 
     def create_filter_by_id(self, document_id):
         return MetadataFilters(
@@ -49,45 +47,95 @@ class LlamaIndex:
             ]
         )
 
-    def create_index(self):
-        print("Creating index...")
-        self.index = VectorStoreIndex.from_documents([])
-        self.index.set_index_id("vector_index")
-        self.index.storage_context.persist("./storage")
+    def as_retriever(self, document_id: str, top_k: int, mode: str = VECTOR) -> BaseRetriever:
+        if not self.index or not self.lexical:
+            raise Exception("Index not found!")
+
+        retriever = self.index.as_retriever(
+            filters=self.create_filter_by_id(document_id),
+            similarity_top_k=top_k,
+        )
+        if mode == VECTOR:
+            return retriever
+
+        # Combine with the BM25 index of the document
+        return HybridRetriever(
+            retriever,
+            self.index.vector_store,
+            self.lexical,
+            document_id,
+            top_k,
+            mode=mode,
+        )
 
     def create_index_from_document(self, document_id):
         # Parse the document
         path = os.path.join("uploads", document_id)
-        documents = self.parse_with_markitdown(document_id, path)
-        self.index = VectorStoreIndex.from_documents(documents)
+        documents = self.parser.parse_with_markitdown(document_id, path)
+        nodes = self.parser.get_nodes(documents)
+        self.parser.embed_nodes(nodes)
+        self.index = VectorStoreIndex(nodes=nodes)
 
     def add_document_to_index(self, document_id):
         # Check if we have an index
         if not self.index:
             raise Exception("Index not found!")
 
+        # Parse and embed the document page by page
         path = os.path.join("uploads", document_id)
-        documents = self.parse_with_markitdown(document_id, path)
-        for doc in documents:
-            self.index.insert(doc)
+        documents = self.parser.parse_with_markitdown(document_id, path)
+        nodes = self.parser.get_nodes(documents)
+        self.parser.embed_nodes(nodes)
 
-        # Refresh the index
-        self.index.refresh(documents)
-
-        # Save index to disk
-        self.index.set_index_id("vector_index")
-        self.index.storage_context.persist("./storage")
+        self.add_nodes_to_index(nodes)
         print("Document added to index!")
 
-    def parse_with_markitdown(self, document_id, file_path) -> list[Document]:
-        # Parse the pdf
-        result = self.md.convert(file_path)
-
-        # Create documents
-        return [
-            Document(
-                text=result.text_content,
-                id_=document_id,
-                metadata={"id_": document_id}
-            )
-        ]
\ No newline at end of file
+    def add_nodes_to_index(self, nodes: list[BaseNode]):
+        # Check if we have an index
+        if not self.index:
+            raise Exception("Index not found!")
+
+        # Nodes are already embedded by the ingestion workers.
+        # The stores append them to the database in a single transaction.
+        db = self.index.vector_store.client
+        document_ids = {node.metadata.get("id_") or node.ref_doc_id for node in nodes}
+        try:
+            with db.transaction():
+                self.index.insert_nodes(nodes)
+                for document_id in document_ids:
+                    self.lexical.build(document_id)
+        except Exception:
+            # Drop the in-memory changes of the failed transaction
+            self.load()
+            raise
+
+        # Train the IVF indexes here, under the ingestion lock, so queries only load them
+        for document_id in document_ids:
+            try:
+                self.index.vector_store.build_ivf(document_id)
+            except Exception:
+                # Queries fall back to exact search without one
+                traceback.print_exc()
+
+        # Notify the listeners about the changed documents
+        for document_id in document_ids:
+            for listener in self.listeners:
+                listener(document_id)
+
+    def delete_document(self, document_id: str):
+        if not self.index or not self.lexical:
+            raise Exception("Index not found!")
+
+        # Remove the nodes, embeddings and BM25 index of the document together
+        db = self.index.vector_store.client
+        with db.transaction():
+            self.index.vector_store.delete(document_id)
+            self.lexical.delete(document_id)
+
+        for listener in self.listeners:
+            listener(document_id)
+
+    def compact(self):
+        if not self.index:
+            raise Exception("Index not found!")
+        self.index.vector_store.client.compact()
\ No newline at end of file
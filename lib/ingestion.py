@@ -0,0 +1,212 @@
+import os
+import asyncio
+import traceback
+import multiprocessing
+from datetime import datetime
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+
+import lib.helpers as helpers
+from lib.index import LlamaIndex
+from lib.embeddings import use_embedding_cache, DEFAULT_CACHE_SIZE
+from lib.parser import (
+    DocumentParser, DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_CONCURRENCY
+)
+from lib.database import Database, create_engine
+from lib.conversion import (
+    PAGE_BREAK, count_pages, convert_pages, get_page_ranges, get_markdown_path, is_pdf, save_markdown
+)
+from lib.models import Documents, Jobs, JobState
+from llama_index.core.schema import BaseNode
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Worker process state
+_parser: Optional[DocumentParser] = None
+_engine: Optional[Engine] = None
+
+def init_worker():
+    global _parser, _engine
+    helpers.set_env()
+    use_embedding_cache(max_size=helpers.get_int("EMBEDDING_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    _parser = DocumentParser(
+        embed_batch_size=helpers.get_int("EMBED_BATCH_SIZE", DEFAULT_EMBED_BATCH_SIZE),
+        embed_concurrency=helpers.get_int("EMBED_CONCURRENCY", DEFAULT_EMBED_CONCURRENCY),
+    )
+    _engine = create_engine()
+
+def update_job(job: Jobs, state: JobState, progress: float, error: Optional[str] = None):
+    job.state = state
+    job.progress = progress
+    job.error = error
+    job.updated_at = datetime.now()
+
+def set_state(engine: Engine, document_id: str, state: JobState, progress: float, error: Optional[str] = None):
+    with Session(engine) as session:
+        job = session.get(Jobs, document_id)
+        if not job:
+            return
+        update_job(job, state, progress, error)
+        session.add(job)
+        session.commit()
+
+def run_job(document_id: str) -> list[BaseNode]:
+    if not _parser or not _engine:
+        raise Exception("Worker not initialized!")
+
+    # Parse the document, from the cached conversion if there is one
+    path = os.path.join("uploads", document_id)
+    documents = _parser.parse_with_markitdown(document_id, path)
+    nodes = _parser.get_nodes(documents)
+
+    # Embed the nodes
+    set_state(_engine, document_id, JobState.EMBEDDING, 0.5)
+    _parser.embed_nodes(nodes)
+    return nodes
+
+class IngestionQueue:
+    def __init__(self, database: Database, index: LlamaIndex, workers: int):
+        self.database = database
+        self.index = index
+        self.workers = workers
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+        # Only one job can write to the index at a time
+        self.lock = asyncio.Lock()
+        self.tasks: set[asyncio.Task] = set()
+        self.compaction: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+
+        # Resume the jobs that didn't finish before the last shutdown
+        async with self.database.session() as session:
+            jobs = (await session.exec(
+                select(Jobs).where(Jobs.state.not_in([JobState.PERSISTED, JobState.FAILED]))
+            )).all()
+        for job in jobs:
+            self.schedule(job.id)
+
+    async def join(self):
+        # Wait for the scheduled jobs to finish
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.compaction:
+            self.compaction.cancel()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def enqueue(self, document: Documents):
+        # Add the document and its job together
+        async def insert(session: AsyncSession):
+            session.add(document)
+            session.add(Jobs(id=document.id))
+        await self.database.write(insert)
+        self.schedule(document.id)
+
+    async def set_state(self, document_id: str, state: JobState, progress: float, error: Optional[str] = None):
+        async def update(session: AsyncSession):
+            job = await session.get(Jobs, document_id)
+            if job:
+                update_job(job, state, progress, error)
+                session.add(job)
+        await self.database.write(update)
+
+    def is_running(self, document_id: str) -> bool:
+        return any(task.get_name() == document_id for task in self.tasks)
+
+    async def compact(self):
+        async with self.lock:
+            await asyncio.to_thread(self.index.compact)
+
+    def schedule_compaction(self):
+        # Compact once no other job is queued, so a VACUUM never holds up a waiting job
+        current = asyncio.current_task()
+        if any(task is not current and not task.done() for task in self.tasks):
+            return
+        if self.compaction and not self.compaction.done():
+            return
+        self.compaction = asyncio.create_task(self.compact_in_background())
+
+    async def compact_in_background(self):
+        # A failed compaction leaves the index as it was, so it is only logged
+        try:
+            await self.compact()
+        except Exception:
+            traceback.print_exc()
+
+    async def delete(self, document: Documents):
+        # Remove the document from the index first, then its rows and files
+        async with self.lock:
+            await asyncio.to_thread(self.index.delete_document, document.id)
+
+        async def remove(session: AsyncSession):
+            job = await session.get(Jobs, document.id)
+            if job:
+                await session.delete(job)
+                await session.flush()
+            await session.delete(await session.merge(document))
+        await self.database.write(remove)
+
+        for path in (os.path.join("uploads", document.id), get_markdown_path(document.id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def schedule(self, document_id: str):
+        task = asyncio.create_task(self.process(document_id), name=document_id)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def convert(self, document_id: str):
+        path = os.path.join("uploads", document_id)
+        if os.path.exists(get_markdown_path(document_id)) or not is_pdf(path):
+            return
+
+        # Convert page ranges of the PDF across the workers
+        loop = asyncio.get_running_loop()
+        pages = await loop.run_in_executor(self.pool, count_pages, path)
+        ranges = get_page_ranges(pages)
+        done = 0
+
+        async def run(start: int, end: int) -> list[str]:
+            nonlocal done
+            texts = await loop.run_in_executor(self.pool, convert_pages, path, start, end)
+            done += 1
+            await self.set_state(document_id, JobState.PARSING, 0.5 * done / len(ranges))
+            return texts
+
+        results = await asyncio.gather(*(run(start, end) for start, end in ranges))
+        markdown = PAGE_BREAK.join(text for texts in results for text in texts)
+        await asyncio.to_thread(save_markdown, document_id, markdown)
+
+    async def process(self, document_id: str):
+        loop = asyncio.get_running_loop()
+        try:
+            # Convert the document, then parse and embed it in a worker process
+            await self.set_state(document_id, JobState.PARSING, 0.0)
+            await self.convert(document_id)
+            nodes = await loop.run_in_executor(self.pool, run_job, document_id)
+
+            # Write the nodes to the index
+            async with self.lock:
+                await asyncio.to_thread(self.index.add_nodes_to_index, nodes)
+            await self.set_state(document_id, JobState.PERSISTED, 1.0)
+            print("Document added to index!")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            traceback.print_exc()
+            await self.set_state(document_id, JobState.FAILED, 0.0, str(e))
+            return
+
+        # Compact the storage in the background, outside of the job
+        self.schedule_compaction()
@@ -0,0 +1,230 @@
+import re
+import json
+import math
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# Reciprocal rank fusion constant
+RRF_K = 60
+
+# Retrieval modes
+VECTOR = "vector"
+HYBRID = "hybrid"
+LEXICAL = "lexical"
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[.\-/]\w+)*")
+
+def tokenize(text: str) -> List[str]:
+    # Keep clause numbers and codes like "4.2.1" or "ab-12" whole, and their parts
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.findall(r"\w+", token))
+    return tokens
+
+class BM25Index:
+    """Inverted index of the chunks of a single document."""
+
+    def __init__(self, ids: List[str], lengths: List[int], postings: dict[str, Tuple[List[int], List[int]]]):
+        self.ids = ids
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.avgdl = float(self.lengths.mean()) if ids else 0.0
+        self.postings = {
+            term: (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+            for term, (rows, tfs) in postings.items()
+        }
+
+    @classmethod
+    def build(cls, ids: List[str], texts: List[str]) -> "BM25Index":
+        lengths = []
+        postings: dict[str, Tuple[List[int], List[int]]] = {}
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                rows, tfs = postings.setdefault(term, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+        return cls(ids, lengths, postings)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "ids": self.ids,
+            "lengths": self.lengths.astype(int).tolist(),
+            "postings": {
+                term: [rows.tolist(), tfs.astype(int).tolist()]
+                for term, (rows, tfs) in self.postings.items()
+            },
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> "BM25Index":
+        d = json.loads(data)
+        return cls(d["ids"], d["lengths"], {term: (rows, tfs) for term, (rows, tfs) in d["postings"].items()})
+
+    def search(self, query: str, k: int) -> List[Tuple[float, str]]:
+        n = len(self.ids)
+        scores = np.zeros(n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, tfs = self.postings[term]
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = K1 * (1 - B + B * self.lengths[rows] / max(self.avgdl, 1e-10))
+            scores[rows] += idf * tfs * (K1 + 1) / (tfs + norm)
+
+        k = min(k, int((scores > 0).sum()))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.ids[i]) for i in top]
+
+class LexicalStore:
+    """Stores a BM25 index per document next to the vector store."""
+
+    def __init__(self, db: Any, max_loaded: int = 64):
+        self.db = db
+        self.max_loaded = max_loaded
+        self.loaded: "OrderedDict[str, BM25Index]" = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped when the index of a document changes, to detect stale reads
+        self.generations: dict[str, int] = dict()
+
+        with db.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lexical ("
+                "document_id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+            )
+
+    def build(self, document_id: str) -> Optional[BM25Index]:
+        # Index all the chunks of the document, read in the same transaction
+        # so that a concurrent write isn't overwritten with older nodes
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, node FROM nodes WHERE document_id = ?", (document_id,)
+            ).fetchall()
+            if not rows:
+                return None
+            texts = [
+                metadata_dict_to_node(json.loads(content)).get_content(metadata_mode=MetadataMode.NONE)
+                for _, content in rows
+            ]
+            index = BM25Index.build([node_id for node_id, _ in rows], texts)
+            conn.execute(
+                "INSERT OR REPLACE INTO lexical (document_id, data) VALUES (?, ?)",
+                (document_id, index.to_json())
+            )
+            self.db.after_commit(lambda: self.unload(document_id))
+        return index
+
+    def delete(self, document_id: str):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM lexical WHERE document_id = ?", (document_id,))
+            self.db.after_commit(lambda: self.unload(document_id))
+
+    def unload(self, document_id: str):
+        with self.lock:
+            self.generations[document_id] = self.generations.get(document_id, 0) + 1
+            self.loaded.pop(document_id, None)
+
+    def get(self, document_id: str) -> Optional[BM25Index]:
+        with self.lock:
+            index = self.loaded.get(document_id)
+            if index:
+                self.loaded.move_to_end(document_id)
+                return index
+            generation = self.generations.get(document_id, 0)
+
+        row = self.db.conn.execute(
+            "SELECT data FROM lexical WHERE document_id = ?", (document_id,)
+        ).fetchone()
+        if row:
+            index = BM25Index.from_json(row[0])
+        else:
+            # Documents indexed before BM25, or migrated, get theirs on first use
+            index = self.build(document_id)
+            if index is None:
+                return None
+
+        with self.lock:
+            # Not kept if the index changed while it was read
+            if self.generations.get(document_id, 0) != generation:
+                return index
+            self.loaded[document_id] = index
+            while len(self.loaded) > self.max_loaded:
+                self.loaded.popitem(last=False)
+        return index
+
+class HybridRetriever(BaseRetriever):
+    """Combines vector and BM25 retrieval for a single document.
+
+    In lexical mode the query isn't embedded at all.
+    """
+
+    def __init__(
+        self,
+        vector_retriever: BaseRetriever,
+        vector_store: Any,
+        lexical: LexicalStore,
+        document_id: str,
+        top_k: int,
+        mode: str = HYBRID,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.vector_retriever = vector_retriever
+        self.vector_store = vector_store
+        self.lexical = lexical
+        self.document_id = document_id
+        self.top_k = top_k
+        self.mode = mode
+
+    def _lexical(self, query: str) -> List[Tuple[float, str]]:
+        index = self.lexical.get(self.document_id)
+        return index.search(query, self.top_k) if index else []
+
+    def _fuse(self, vector_nodes: List[NodeWithScore], lexical: List[Tuple[float, str]]) -> List[NodeWithScore]:
+        if self.mode == LEXICAL:
+            ids = [node_id for _, node_id in lexical]
+            scores = {node_id: score for score, node_id in lexical}
+            return [
+                NodeWithScore(node=node, score=scores[node.node_id])
+                for node in self.vector_store.get_nodes_by_id(ids)
+            ]
+
+        # Reciprocal rank fusion
+        scores: dict[str, float] = {}
+        nodes = {n.node.node_id: n.node for n in vector_nodes}
+        for rank, n in enumerate(vector_nodes):
+            scores[n.node.node_id] = scores.get(n.node.node_id, 0.0) + 1 / (RRF_K + rank + 1)
+        for rank, (_, node_id) in enumerate(lexical):
+            scores[node_id] = scores.get(node_id, 0.0) + 1 / (RRF_K + rank + 1)
+
+        top = sorted(scores, key=scores.get, reverse=True)[:self.top_k]
+        missing = [node_id for node_id in top if node_id not in nodes]
+        if missing:
+            nodes.update({node.node_id: node for node in self.vector_store.get_nodes_by_id(missing)})
+        return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in top if node_id in nodes]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        lexical = self._lexical(query_bundle.query_str)
+        vector_nodes = [] if self.mode == LEXICAL else self.vector_retriever.retrieve(query_bundle)
+        return self._fuse(vector_nodes, lexical)
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        lexical = self._lexical(query_bundle.query_str)
+        vector_nodes = [] if self.mode == LEXICAL else await self.vector_retriever.aretrieve(query_bundle)
+        return self._fuse(vector_nodes, lexical)
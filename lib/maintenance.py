@@ -0,0 +1,168 @@
+import os
+import shutil
+from hashlib import sha256
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from lib.database import Database
+from lib.index import LlamaIndex
+from lib.ingestion import IngestionQueue, update_job
+from lib.models import Documents, Jobs, JobState
+from lib.storage import STORAGE_DIR, ANN_DIR, QUANTIZED_DIR
+
+# Marks a reindex that didn't finish
+REINDEX_MARKER = os.path.join(STORAGE_DIR, "reindex")
+
+# Size of the chunks read when hashing an upload
+HASH_CHUNK_SIZE = 1024 * 1024
+
+async def get_documents(database: Database) -> list[Documents]:
+    async with database.session() as session:
+        return list((await session.exec(select(Documents))).all())
+
+async def get_jobs(database: Database) -> dict[str, Jobs]:
+    async with database.session() as session:
+        return {job.id: job for job in (await session.exec(select(Jobs))).all()}
+
+def hash_file(path: str) -> str:
+    hash = sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+async def reindex(database: Database, llama_index: LlamaIndex, ingestion: IngestionQueue) -> dict[str, int]:
+    documents = await get_documents(database)
+
+    if os.path.exists(REINDEX_MARKER):
+        print("Resuming the previous reindex...")
+    else:
+        # Queue every document again before dropping the index,
+        # so that an interrupted reindex resumes where it stopped
+        async def reset(session: AsyncSession):
+            for document in documents:
+                job = await session.get(Jobs, document.id) or Jobs(id=document.id)
+                update_job(job, JobState.QUEUED, 0.0)
+                session.add(job)
+        await database.write(reset)
+
+        shutil.rmtree(STORAGE_DIR, ignore_errors=True)
+        llama_index.load()
+        with open(REINDEX_MARKER, "w"):
+            pass
+
+    # Documents without their upload can't be reindexed
+    for document in documents:
+        if not os.path.exists(os.path.join("uploads", document.id)):
+            await ingestion.set_state(document.id, JobState.FAILED, 0.0, "Upload not found.")
+
+    # Parse and embed the queued documents across the ingestion workers
+    await ingestion.start()
+    await ingestion.join()
+    ingestion.shutdown()
+    os.remove(REINDEX_MARKER)
+
+    jobs = await get_jobs(database)
+    states = [jobs[document.id].state for document in documents if document.id in jobs]
+    return {
+        "documents": len(documents),
+        "persisted": states.count(JobState.PERSISTED),
+        "failed": states.count(JobState.FAILED),
+    }
+
+async def compact(database: Database, llama_index: LlamaIndex) -> dict[str, int]:
+    if not llama_index.index or not llama_index.lexical:
+        raise Exception("Index not found!")
+    vector_store = llama_index.index.vector_store
+    db = vector_store.client
+    before = os.path.getsize(db.path)
+
+    # Drop the nodes of documents that no longer exist
+    document_ids = {document.id for document in await get_documents(database)}
+    removed = 0
+    for document_id in set(vector_store.list_partitions()) - document_ids:
+        vector_store.delete(document_id)
+        removed += 1
+
+    # Drop the BM25 indexes, IVF and quantized files without nodes
+    live = set(vector_store.list_partitions())
+    for document_id, in db.conn.execute("SELECT document_id FROM lexical").fetchall():
+        if document_id not in live:
+            llama_index.lexical.delete(document_id)
+    if os.path.isdir(ANN_DIR):
+        for name in os.listdir(ANN_DIR):
+            if name.endswith(".npz") and name.removesuffix(".npz") not in live:
+                os.remove(os.path.join(ANN_DIR, name))
+    if os.path.isdir(QUANTIZED_DIR):
+        for name in os.listdir(QUANTIZED_DIR):
+            if name not in live:
+                shutil.rmtree(os.path.join(QUANTIZED_DIR, name), ignore_errors=True)
+
+    # Train the IVF indexes that are missing, e.g. after switching to VECTOR_SEARCH=ivf
+    if vector_store.search_mode == "ivf":
+        for document_id in live:
+            if not os.path.exists(vector_store.get_ann_path(document_id)):
+                vector_store.build_ivf(document_id)
+
+    # Rewrite the database file without the free pages
+    db.compact(force=True)
+    return {
+        "removed_documents": removed,
+        "bytes_before": before,
+        "bytes_after": os.path.getsize(db.path),
+    }
+
+async def verify(database: Database, llama_index: LlamaIndex) -> list[str]:
+    if not llama_index.index or not llama_index.lexical:
+        raise Exception("Index not found!")
+    db = llama_index.index.vector_store.client
+    problems: list[str] = []
+
+    documents = await get_documents(database)
+    jobs = await get_jobs(database)
+    counts = dict(db.conn.execute("SELECT document_id, COUNT(*) FROM nodes GROUP BY document_id").fetchall())
+
+    for document in documents:
+        # The upload is stored under the hash of its content
+        path = os.path.join("uploads", document.id)
+        if not os.path.exists(path):
+            problems.append(f"{document.id}: upload not found")
+        elif hash_file(path) != document.id:
+            problems.append(f"{document.id}: upload doesn't match its hash")
+
+        job = jobs.get(document.id)
+        if not job:
+            problems.append(f"{document.id}: no ingestion job")
+        elif job.state == JobState.FAILED:
+            problems.append(f"{document.id}: ingestion failed: {job.error}")
+        elif job.state == JobState.PERSISTED and not counts.get(document.id):
+            problems.append(f"{document.id}: ingested but not in the index")
+
+        if counts.get(document.id):
+            lexical = llama_index.lexical.get(document.id)
+            if not lexical:
+                problems.append(f"{document.id}: no keyword index")
+            elif len(lexical.ids) != counts[document.id]:
+                problems.append(f"{document.id}: keyword index is out of date")
+
+    # Leftovers of documents that no longer exist
+    document_ids = {document.id for document in documents}
+    for document_id in counts.keys() - document_ids:
+        problems.append(f"{document_id}: in the index without a document")
+    if os.path.isdir("uploads"):
+        for name in os.listdir("uploads"):
+            if name not in document_ids:
+                problems.append(f"{name}: upload without a document")
+
+    # All the embeddings come from the same model
+    sizes = db.conn.execute("SELECT DISTINCT LENGTH(embedding) FROM nodes").fetchall()
+    if len(sizes) > 1:
+        problems.append(f"index: embeddings of {len(sizes)} different sizes, reindex to fix")
+
+    # Corruption of the database files
+    if (result := db.conn.execute("PRAGMA integrity_check").fetchone()[0]) != "ok":
+        problems.append(f"index: {result}")
+    async with database.engine.connect() as conn:
+        if (result := (await conn.exec_driver_sql("PRAGMA integrity_check")).scalar()) != "ok":
+            problems.append(f"database: {result}")
+    return problems
@@ -1,53 +1,212 @@
+import os
+import math
 import time
+import asyncio
 import aiohttp
-from lib.helpers import get_env
+import traceback
+from collections import deque
+from contextlib import asynccontextmanager
+from multiprocessing.process import BaseProcess
+from typing import AsyncIterator, Optional
+from lib.helpers import get_env, get_int, get_float
 from lib.models import Documents
+from lib.bots.pool import BotPool, stop_processes, DEFAULT_SHUTDOWN_TIMEOUT
 
 # Daily REST API
 from pipecat.transports.services.helpers.daily_rest import (
     DailyRESTHelper, DailyRoomParams, DailyRoomProperties
 )
 
+# Lifetime of a room in seconds
+ROOM_EXPIRY = 1800
+
+# Admission defaults
+DEFAULT_MIN_AVAILABLE_MEMORY = 512 * 1024 * 1024
+DEFAULT_QUEUE_TIMEOUT = 10.0
+
+# Seconds between memory checks while a connect is queued
+MEMORY_POLL_INTERVAL = 1.0
+
+class Overloaded(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def get_available_memory() -> Optional[int]:
+    # Memory available for new processes, on Linux
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
 class ConnectionManager:
     def __init__(self):
         self.env = get_env()
-        self.processes = dict()
+        self.processes: dict[int, BaseProcess] = dict()
+
+        # Admission limits for new bots
+        self.max_bots = get_int("MAX_BOTS", os.cpu_count() or 1)
+        self.min_available_memory = get_int("MIN_AVAILABLE_MEMORY", DEFAULT_MIN_AVAILABLE_MEMORY)
+        self.queue_timeout = get_float("BOT_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        self.shutdown_timeout = get_float("BOT_SHUTDOWN_TIMEOUT", DEFAULT_SHUTDOWN_TIMEOUT)
+
+        # Slots taken by connects that haven't started their bot yet
+        self.reserved = 0
+        self.slot_freed = asyncio.Event()
+
+        # Warm bot workers
+        self.pool = BotPool(size=get_int("BOT_POOL_SIZE", 2))
+
+        # Pre-created rooms and tokens as (room_url, token, exp)
+        self.rooms: deque[tuple[str, str, float]] = deque()
+        self.room_pool_size = get_int("ROOM_POOL_SIZE", 2)
+        self.room_min_ttl = get_int("ROOM_MIN_TTL", 1500)
+        self.refill_event = asyncio.Event()
+        self.refill_task: Optional[asyncio.Task] = None
+
+        # Shared HTTP session for the Daily REST API
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.helper: Optional[DailyRESTHelper] = None
 
         # Store sessions
         self.document: Documents
 
-    def terminate_processes(self):
+    async def start(self):
+        self.session = aiohttp.ClientSession()
+        self.helper = DailyRESTHelper(
+            daily_api_key=self.env["DAILY_API_KEY"],
+            daily_api_url=self.env.get("DAILY_API_URL", "https://api.daily.co/v1"),
+            aiohttp_session=self.session,
+        )
+        self.refill_task = asyncio.create_task(self.refill_rooms())
+        self.pool.start()
+
+    async def close(self):
+        if self.refill_task:
+            self.refill_task.cancel()
+        if self.session:
+            await self.session.close()
+
+    async def terminate_processes(self):
         for process in self.processes.values():
-            process.terminate()
-            process.wait()
+            self.unwatch(process)
+
+        # Stop the warm workers and the running bots together, under one deadline,
+        # without blocking the event loop while they exit
+        processes = [*self.pool.drain(), *self.processes.values()]
+        self.processes.clear()
+        await asyncio.to_thread(stop_processes, processes, self.shutdown_timeout)
 
     def add_process(self, pid, proc):
         self.processes[pid] = proc
 
-    async def create_room_and_token(self) -> tuple[str, str]:
-        # Create aiohttp session
-        async with aiohttp.ClientSession() as session:
-            # Set Daily REST API helper
-            helper = DailyRESTHelper(
-                daily_api_key=self.env["DAILY_API_KEY"],
-                daily_api_url="https://api.daily.co/v1",
-                aiohttp_session=session,
-            )
+        # Reap the bot as soon as it exits
+        asyncio.get_running_loop().add_reader(proc.sentinel, self.reap, pid)
 
-            # Create a room
-            room = await helper.create_room(
-                params=DailyRoomParams(
-                    privacy="private",
-                    properties=DailyRoomProperties(
-                        enable_chat=True,
-                        exp=time.time() + 1800
-                    )
+    def unwatch(self, process: BaseProcess):
+        try:
+            asyncio.get_running_loop().remove_reader(process.sentinel)
+        except (RuntimeError, ValueError):
+            pass
+
+    def reap(self, pid: int):
+        process = self.processes.pop(pid, None)
+        if process:
+            self.unwatch(process)
+            process.join()
+            self.slot_freed.set()
+
+    def admissible(self) -> bool:
+        if len(self.processes) + self.reserved >= self.max_bots:
+            return False
+        available = get_available_memory()
+        return available is None or available >= self.min_available_memory
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        # Wait for a free slot, or reject the connect after the queue timeout
+        deadline = time.monotonic() + self.queue_timeout
+        while not self.admissible():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Overloaded("Too many active calls.", retry_after=max(math.ceil(self.queue_timeout), 1))
+            self.slot_freed.clear()
+            try:
+                await asyncio.wait_for(self.slot_freed.wait(), timeout=min(remaining, MEMORY_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+        # Hold the slot until the bot is started
+        self.reserved += 1
+        try:
+            yield
+        finally:
+            self.reserved -= 1
+            self.slot_freed.set()
+
+    async def start_bot(self, room_url: str, token: str, document_id: str):
+        # Hand the room over to a warm worker
+        process = await self.pool.launch(room_url, token, document_id)
+        self.add_process(process.pid, process)
+
+    async def refill_rooms(self):
+        while True:
+            # Drop the rooms that would expire too soon
+            now = time.time()
+            while self.rooms and self.rooms[0][2] - now < self.room_min_ttl:
+                self.rooms.popleft()
+
+            try:
+                while len(self.rooms) < self.room_pool_size:
+                    self.rooms.append(await self.create_room())
+            except Exception:
+                traceback.print_exc()
+
+            # Wake up when a room is taken or the oldest one gets stale
+            timeout = self.rooms[0][2] - self.room_min_ttl - time.time() if self.rooms else 60
+            self.refill_event.clear()
+            try:
+                await asyncio.wait_for(self.refill_event.wait(), timeout=max(timeout, 1))
+            except asyncio.TimeoutError:
+                pass
+
+    async def create_room(self) -> tuple[str, str, float]:
+        if not self.helper:
+            raise Exception("Connection manager not started!")
+
+        # Create a room
+        exp = time.time() + ROOM_EXPIRY
+        room = await self.helper.create_room(
+            params=DailyRoomParams(
+                privacy="private",
+                properties=DailyRoomProperties(
+                    enable_chat=True,
+                    exp=exp
                 )
             )
+        )
 
-            # Generate a token for the room
-            token = await helper.get_token(
-                room_url=room.url,
-                owner=True
-            )
-        return room.url, token
\ No newline at end of file
+        # Generate a token for the room
+        token = await self.helper.get_token(
+            room_url=room.url,
+            owner=True
+        )
+        return room.url, token, exp
+
+    async def create_room_and_token(self) -> tuple[str, str]:
+        # Take a pre-created room if there is a fresh one
+        now = time.time()
+        while self.rooms:
+            room_url, token, exp = self.rooms.popleft()
+            if exp - now >= self.room_min_ttl:
+                self.refill_event.set()
+                return room_url, token
+
+        # Otherwise create one on the spot
+        self.refill_event.set()
+        room_url, token, _ = await self.create_room()
+        return room_url, token
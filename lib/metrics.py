@@ -0,0 +1,120 @@
+import time
+import threading
+from typing import Optional
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0)
+
+# Points in time of a voice turn, in order
+STAGES = ["vad_end", "stt_final", "retrieval_done", "first_token", "first_audio", "audio_end"]
+
+# Durations reported for a turn, as (name, start, end)
+DURATIONS = [
+    ("stt", "vad_end", "stt_final"),
+    ("retrieval", "stt_final", "retrieval_done"),
+    ("llm_first_token", "retrieval_done", "first_token"),
+    ("tts_first_audio", "first_token", "first_audio"),
+    ("audio", "first_audio", "audio_end"),
+    ("response", "vad_end", "first_audio"),
+]
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series: dict[tuple, tuple[list[int], list[float]]] = dict()
+
+    def observe(self, value: float, **labels: str):
+        counts, total = self.series.setdefault(tuple(sorted(labels.items())), ([0] * (len(self.buckets) + 1), [0.0]))
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        counts[-1] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self.series.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': str(bound)})} {count}")
+            lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': '+Inf'})} {counts[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total[0]}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {counts[-1]}")
+        return lines
+
+class Counter:
+    def __init__(self, name: str, help: str, type: str = "counter"):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.series: dict[tuple, float] = dict()
+
+    def inc(self, value: float = 1, **labels: str):
+        key = tuple(sorted(labels.items()))
+        self.series[key] = self.series.get(key, 0) + value
+
+    def set(self, value: float, **labels: str):
+        self.series[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, value in self.series.items():
+            lines.append(f"{self.name}{format_labels(dict(key))} {value}")
+        return lines
+
+class Registry:
+    """Metrics aggregated by the server, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turn_seconds = Histogram("codex_turn_stage_seconds", "Duration of the stages of a voice turn.")
+        self.turns = Counter("codex_turns_total", "Number of voice turns.")
+        self.tokens = Counter("codex_llm_tokens_estimated_total", "Estimated number of LLM tokens, counted with tiktoken.")
+        self.answer_cache = Counter("codex_answer_cache", "Answer cache statistics.", type="gauge")
+
+    def observe_turn(self, durations: dict[str, float], tokens: dict[str, int]):
+        with self.lock:
+            self.turns.inc()
+            for stage, seconds in durations.items():
+                self.turn_seconds.observe(seconds, stage=stage)
+            for kind, count in tokens.items():
+                self.tokens.inc(count, kind=kind)
+
+    def set_answer_cache_stats(self, stats: dict):
+        with self.lock:
+            for key, value in stats.items():
+                self.answer_cache.set(value, stat=key)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = [self.turn_seconds, self.turns, self.tokens, self.answer_cache]
+            return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+class TurnTimer:
+    """Marks the stages of the current voice turn in a bot."""
+
+    def __init__(self):
+        self.marks: dict[str, float] = dict()
+        self.tokens: dict[str, int] = dict()
+
+    def reset(self):
+        self.marks = dict()
+        self.tokens = dict()
+
+    def mark(self, stage: str, at: Optional[float] = None):
+        # Only the first occurrence of a stage counts
+        self.marks.setdefault(stage, at or time.monotonic())
+
+    def durations(self) -> dict[str, float]:
+        return {
+            name: self.marks[end] - self.marks[start]
+            for name, start, end in DURATIONS
+            if start in self.marks and end in self.marks
+        }
@@ -1,10 +1,13 @@
-from typing import TypedDict
+from enum import Enum
+from typing import NotRequired, Optional, TypedDict
 from datetime import datetime
+from pydantic import BaseModel
 from sqlmodel import SQLModel, Field
 
 # SQLModel configuration
 sqlite_file_name = "codex.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_file_name}"
 connect_args = {"check_same_thread": False}
 
 class Documents(SQLModel, table=True):
@@ -28,9 +31,78 @@ class Documents(SQLModel, table=True):
         description="The date and time the document was created",
     )
 
+class JobState(str, Enum):
+    QUEUED = "queued"
+    PARSING = "parsing"
+    EMBEDDING = "embedding"
+    PERSISTED = "persisted"
+    FAILED = "failed"
+
+class Jobs(SQLModel, table=True):
+    id: str = Field(
+        primary_key=True,
+        foreign_key="documents.id",
+        description="The ID of the document being ingested",
+    )
+    state: JobState = Field(
+        default=JobState.QUEUED,
+        index=True,
+        description="The current stage of the ingestion",
+    )
+    progress: float = Field(
+        default=0.0,
+        description="The progress of the ingestion between 0 and 1",
+    )
+    error: Optional[str] = Field(
+        default=None,
+        description="The error message if the ingestion failed",
+    )
+    created_at: datetime = Field(
+        default_factory=datetime.now,
+        description="The date and time the job was created",
+    )
+    updated_at: datetime = Field(
+        default_factory=datetime.now,
+        description="The date and time the job was last updated",
+    )
+
+class BatchQuery(BaseModel):
+    questions: list[str]
+
+class ChatQuery(BaseModel):
+    question: str
+    session_id: Optional[str] = None
+
 class Environment(TypedDict):
     OPENAI_API_KEY: str
     DEEPGRAM_API_KEY: str
     ELEVENLABS_API_KEY: str
     DAILY_API_KEY: str
-    DAILY_ROOM_URL: str
\ No newline at end of file
+    DAILY_ROOM_URL: str
+    MAX_UPLOAD_SIZE: NotRequired[str]
+    INGESTION_WORKERS: NotRequired[str]
+    EMBED_BATCH_SIZE: NotRequired[str]
+    EMBED_CONCURRENCY: NotRequired[str]
+    EMBEDDING_CACHE_SIZE: NotRequired[str]
+    MAX_LOADED_PARTITIONS: NotRequired[str]
+    VECTOR_SEARCH: NotRequired[str]
+    IVF_NLIST: NotRequired[str]
+    IVF_NPROBE: NotRequired[str]
+    ANN_MIN_VECTORS: NotRequired[str]
+    VECTOR_QUANTIZATION: NotRequired[str]
+    RETRIEVAL_SOCKET: NotRequired[str]
+    DATABASE_POOL_SIZE: NotRequired[str]
+    BOT_POOL_SIZE: NotRequired[str]
+    MAX_BOTS: NotRequired[str]
+    MIN_AVAILABLE_MEMORY: NotRequired[str]
+    BOT_QUEUE_TIMEOUT: NotRequired[str]
+    BOT_SHUTDOWN_TIMEOUT: NotRequired[str]
+    ROOM_POOL_SIZE: NotRequired[str]
+    ROOM_MIN_TTL: NotRequired[str]
+    DAILY_API_URL: NotRequired[str]
+    ANSWER_CACHE_THRESHOLD: NotRequired[str]
+    ANSWER_CACHE_TTL: NotRequired[str]
+    ANSWER_CACHE_SIZE: NotRequired[str]
+    ANSWER_LOOKUP_TIMEOUT: NotRequired[str]
+    SPECULATION_THRESHOLD: NotRequired[str]
+    RETRIEVAL_MODE: NotRequired[str]
\ No newline at end of file
@@ -0,0 +1,91 @@
+import asyncio
+from typing import Iterable, Iterator
+from markitdown import MarkItDown
+
+from llama_index.core import Document, Settings
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, MetadataMode
+from lib.engines.citated_query_engine import CITATION_CHUNKS_KEY
+from lib.conversion import PAGE_BREAK, load_markdown, save_markdown
+
+DEFAULT_EMBED_BATCH_SIZE = 256
+DEFAULT_EMBED_CONCURRENCY = 4
+
+# Size of the sources cited in answers
+CITATION_CHUNK_SIZE = 256
+CITATION_CHUNK_OVERLAP = 20
+
+# Metadata that is neither embedded nor shown to the LLM
+HIDDEN_METADATA_KEYS = ["id_", "offset", CITATION_CHUNKS_KEY]
+
+def node_id_func(i: int, doc: BaseNode) -> str:
+    # Stable node IDs, so that re-ingesting a document gives the same nodes
+    return f"{doc.metadata['id_']}-{doc.metadata['page']}-{i}"
+
+class DocumentParser:
+    def __init__(
+        self,
+        embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+        embed_concurrency: int = DEFAULT_EMBED_CONCURRENCY,
+    ):
+        # Create a markdown parser
+        self.md = MarkItDown()
+
+        # Node parser
+        self.splitter = SentenceSplitter(id_func=node_id_func)
+        self.citation_splitter = SentenceSplitter(
+            chunk_size=CITATION_CHUNK_SIZE,
+            chunk_overlap=CITATION_CHUNK_OVERLAP,
+        )
+
+        # Embedding settings
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+
+    def parse_with_markitdown(self, document_id, file_path) -> Iterator[Document]:
+        # Reuse the converted text if the document was parsed before
+        markdown = load_markdown(document_id)
+        if markdown is None:
+            markdown = self.md.convert(file_path).text_content
+            save_markdown(document_id, markdown)
+        return self.parse_markdown(document_id, markdown)
+
+    def parse_markdown(self, document_id: str, markdown: str) -> Iterator[Document]:
+        # Create a document for each page
+        offset = 0
+        for page, text in enumerate(markdown.split(PAGE_BREAK), start=1):
+            if text.strip():
+                yield Document(
+                    text=text,
+                    id_=document_id,
+                    metadata={"id_": document_id, "page": page, "offset": offset},
+                    excluded_embed_metadata_keys=HIDDEN_METADATA_KEYS + ["page"],
+                    excluded_llm_metadata_keys=HIDDEN_METADATA_KEYS,
+                )
+            offset += len(text) + len(PAGE_BREAK)
+
+    def get_nodes(self, documents: Iterable[Document]) -> list[BaseNode]:
+        nodes = []
+        for document in documents:
+            # Split each page on its own
+            for node in self.splitter.get_nodes_from_documents([document]):
+                node.metadata["offset"] = document.metadata["offset"] + (node.start_char_idx or 0)
+
+                # Split the citation sources once instead of on every query
+                node.metadata[CITATION_CHUNKS_KEY] = self.citation_splitter.split_text(
+                    node.get_content(metadata_mode=MetadataMode.NONE)
+                )
+                nodes.append(node)
+        return nodes
+
+    def embed_nodes(self, nodes: list[BaseNode]):
+        # Send large batches concurrently
+        embed_model = Settings.embed_model
+        embed_model.embed_batch_size = self.embed_batch_size
+        embed_model.num_workers = self.embed_concurrency
+
+        # Embed the nodes so that the index doesn't have to
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = asyncio.run(embed_model.aget_text_embedding_batch(texts))
+        for node, embedding in zip(nodes, embeddings):
+            node.embedding = embedding
@@ -0,0 +1,137 @@
+import os
+import time
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+# Representations of the embeddings in memory
+NONE = "none"
+FLOAT16 = "float16"
+INT8 = "int8"
+
+# Rows scored at once, small enough for their float32 copy to stay in the CPU cache
+BLOCK_SIZE = 256
+
+# Candidates rescored with the full precision embeddings, per result
+RESCORE_FACTOR = 4
+MIN_CANDIDATES = 32
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-10)
+
+def save_array(path: str, array: np.ndarray):
+    # Write to a temporary file and move it in place atomically
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+class QuantizedMatrix:
+    """Normalized embeddings as float16, or as int8 with a scale per row.
+
+    Scores are approximate cosine similarities, used to pick the
+    candidates that are rescored with the full precision embeddings.
+    NumPy only uses BLAS for float matrix products, so the codes are scored
+    as float32 block by block: int8 scores about as fast as float32, while
+    float16 is several times slower, since NumPy converts float16 slowly.
+    """
+
+    def __init__(self, codes: np.ndarray, scales: Optional[np.ndarray] = None):
+        self.codes = codes
+        self.scales = scales
+
+    @property
+    def kind(self) -> str:
+        return INT8 if self.codes.dtype == np.int8 else FLOAT16
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def quantize(cls, matrix: np.ndarray, kind: str) -> "QuantizedMatrix":
+        matrix = normalize(matrix.astype(np.float32))
+        if kind == FLOAT16:
+            return cls(matrix.astype(np.float16))
+        if kind == INT8:
+            scales = np.maximum(np.abs(matrix).max(axis=1), 1e-10) / 127
+            codes = np.round(matrix / scales[:, None]).astype(np.int8)
+            return cls(codes, scales.astype(np.float32))
+        raise ValueError(f"Unsupported quantization: {kind}")
+
+    def dequantize(self) -> np.ndarray:
+        matrix = self.codes.astype(np.float32)
+        if self.scales is not None:
+            matrix *= self.scales[:, None]
+        return matrix
+
+    def similarities(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        n = len(self.codes) if rows is None else len(rows)
+        similarities = np.empty(n, dtype=np.float32)
+        for i in range(0, n, BLOCK_SIZE):
+            block = self.codes[i:i + BLOCK_SIZE] if rows is None else self.codes[rows[i:i + BLOCK_SIZE]]
+            similarities[i:i + BLOCK_SIZE] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            similarities *= self.scales if rows is None else self.scales[rows]
+        return similarities
+
+    def save(self, directory: str, ids: list[str]):
+        os.makedirs(directory, exist_ok=True)
+        save_array(os.path.join(directory, "codes.npy"), self.codes)
+        if self.scales is not None:
+            save_array(os.path.join(directory, "scales.npy"), self.scales)
+
+        # Written last, a partition is only valid with matching ids
+        save_array(os.path.join(directory, "ids.npy"), np.array(ids))
+
+    @classmethod
+    def load(cls, directory: str, ids: list[str]) -> Optional["QuantizedMatrix"]:
+        ids_path = os.path.join(directory, "ids.npy")
+        if not os.path.exists(ids_path) or np.load(ids_path).tolist() != ids:
+            return None
+
+        # Memory-mapped, the pages are shared with the page cache
+        codes = np.load(os.path.join(directory, "codes.npy"), mmap_mode="r")
+        if len(codes) != len(ids):
+            return None
+        scales = None
+        if codes.dtype == np.int8:
+            scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r")
+        return cls(codes, scales)
+
+# Benchmark the agreement with exact search
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Quantization benchmark")
+    parser.add_argument("-n", type=int, default=50000, help="Number of vectors")
+    parser.add_argument("-d", type=int, default=1536, help="Dimensions")
+    parser.add_argument("-k", type=int, default=10, help="Top k")
+    parser.add_argument("-q", type=int, default=200, help="Number of queries")
+    args = parser.parse_args()
+
+    # Clustered synthetic data
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(100, args.d)).astype(np.float32)
+    matrix = (centers[rng.integers(0, 100, args.n)] + 0.5 * rng.normal(size=(args.n, args.d))).astype(np.float32)
+    queries = normalize(matrix[rng.choice(args.n, args.q)] + 0.1 * rng.normal(size=(args.q, args.d)).astype(np.float32))
+    norms = np.maximum(np.linalg.norm(matrix, axis=1), 1e-10)
+    start = time.perf_counter()
+    exact = [set(np.argpartition(-(matrix @ q / norms), args.k - 1)[:args.k]) for q in queries]
+    ms = (time.perf_counter() - start) * 1000 / args.q
+    print(f"float32: {matrix.nbytes / 2**20:.1f}MiB {ms:.3f}ms/query")
+
+    candidates = max(args.k * RESCORE_FACTOR, MIN_CANDIDATES)
+    for kind in (FLOAT16, INT8):
+        quantized = QuantizedMatrix.quantize(matrix, kind)
+        start = time.perf_counter()
+        agreement = []
+        for q, e in zip(queries, exact):
+            # Candidates from the quantized scores, rescored exactly
+            top = np.argpartition(-quantized.similarities(q), candidates - 1)[:candidates]
+            scores = matrix[top] @ q / norms[top]
+            result = set(top[np.argpartition(-scores, args.k - 1)[:args.k]])
+            agreement.append(len(result & e) / args.k)
+        ms = (time.perf_counter() - start) * 1000 / args.q
+        print(f"{kind}: {quantized.nbytes / 2**20:.1f}MiB top-{args.k} agreement={np.mean(agreement):.3f} {ms:.3f}ms/query")
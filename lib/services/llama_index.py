@@ -1,20 +1,18 @@
-import os
-import re
+import asyncio
+import tiktoken
+import traceback
 from pydantic import BaseModel
-from typing import Literal, Dict, Any
+from typing import Literal, Dict, Any, List, Optional, Tuple
+from lib.helpers import get_float
+from lib.speculation import similarity
+from lib.citations import CitationParser
+from lib.metrics import TurnTimer
 
 # Llama Index
-from llama_index.core.query_engine import (
-    CitationQueryEngine
-)
-from llama_index.core import (
-    StorageContext,
-    load_index_from_storage
-)
-from llama_index.core.vector_stores import (
-    MetadataFilter,
-    MetadataFilters,
-)
+from lib.engines.citated_query_engine import CitatedQueryEngine
+from llama_index.core.query_engine.citation_query_engine import CITATION_QA_TEMPLATE
+from lib.services.retrieval import RetrievalClient, RemoteRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
 
 # Pipecat
 from pipecat.processors.aggregators.openai_llm_context import (
@@ -22,6 +20,7 @@ from pipecat.processors.aggregators.openai_llm_context import (
     OpenAILLMContextFrame,
 )
 from pipecat.services.ai_services import LLMService
+from pipecat.metrics.metrics import LLMTokenUsage
 from pipecat.processors.frame_processor import (
     FrameDirection
 )
@@ -37,13 +36,10 @@ from pipecat.processors.frameworks.rtvi import (
     RTVIMessageLiteral, RTVI_MESSAGE_LABEL
 )
 from llama_index.core import Settings
-from llama_index.llms.openai import OpenAI
+from lib.services.qa import create_llm
 
 # Set the llm model
-Settings.llm = OpenAI(
-    model="gpt-4",
-    temperature=0.5,
-)
+Settings.llm = create_llm()
 
 class RTVICitationsMessage(BaseModel):
     label: RTVIMessageLiteral = RTVI_MESSAGE_LABEL
@@ -54,40 +50,98 @@ class LlamaIndexService(LLMService):
     def __init__(
         self,
         document_id: str,
+        timer: Optional[TurnTimer] = None,
         **kwargs
     ):
         super().__init__(**kwargs)
-        # Load up the index from storage
-        if not os.path.exists("storage"):
-            raise Exception("Index not found!")
-        self.index = load_index_from_storage(
-            StorageContext.from_defaults(persist_dir="storage"),
-            index_id="vector_index"
+        self.document_id = document_id
+        self.timer = timer or TurnTimer()
+        self.encoding = tiktoken.encoding_for_model("gpt-4")
+
+        # Retrieve from the index loaded by the server
+        self.client = RetrievalClient()
+
+        # Answer cache requests use their own connection, so they don't queue behind retrieval
+        self.answers = RetrievalClient()
+        self.answer_lookup_timeout = get_float("ANSWER_LOOKUP_TIMEOUT", 0.5)
+        retriever = RemoteRetriever(
+            self.client,
+            document_id,
+            top_k=3,
         )
 
         # Create query engine
-        filters = self.create_filter_for_id(document_id)
-        retriever = self.index.as_retriever(
-            filters=filters
-        )
-        self.query_engine = CitationQueryEngine.from_args(
-            index=self.index,
-            similarity_top_k=3,
+        self.query_engine = CitatedQueryEngine.from_args(
+            index=None,
             retriever=retriever,
             citation_chunk_size=256,
+            citation_qa_template=CITATION_QA_TEMPLATE,
+            output_cls=None,
             streaming=True
         )
         print("Query engine created!")
 
-    def create_filter_for_id(self, document_id):
-        return MetadataFilters(
-            filters=[
-                MetadataFilter(key="id_", value=document_id)
-            ]
-        )
+        # Retrieval started on an interim transcript
+        self.speculation: Optional[Tuple[str, asyncio.Task]] = None
+        self.speculation_threshold = get_float("SPECULATION_THRESHOLD", 0.9)
+
+    def prefetch(self, text: str):
+        # Skip if we are already retrieving for this text
+        if self.speculation:
+            previous, task = self.speculation
+            if previous == text:
+                return
+            task.cancel()
+
+        task = asyncio.create_task(self.query_engine.aretrieve(QueryBundle(text)))
+        self.speculation = (text, task)
+
+    async def take_speculation(self, message: str) -> Optional[List[NodeWithScore]]:
+        if not self.speculation:
+            return None
+        text, task = self.speculation
+        self.speculation = None
+
+        # Discard the result if the final transcript is different
+        if similarity(text, message) < self.speculation_threshold:
+            task.cancel()
+            return None
+        try:
+            return await task
+        except Exception:
+            return None
+
+    async def retrieve(self, message: str) -> List[NodeWithScore]:
+        # Reuse the speculative retrieval if it matches
+        nodes = await self.take_speculation(message)
+        if nodes is None:
+            nodes = await self.query_engine.aretrieve(QueryBundle(message))
+        return nodes
+
+    async def lookup_answer(self, message: str) -> Optional[Dict[str, Any]]:
+        # The cache is best-effort, so a slow or failed lookup is a miss
+        try:
+            return await asyncio.wait_for(
+                self.answers.request("lookup_answer", document_id=self.document_id, query=message),
+                timeout=self.answer_lookup_timeout,
+            )
+        except Exception:
+            return None
+
+    async def store_answer(self, message: str, answer: str, sources: List[str]):
+        try:
+            await self.answers.request(
+                "store_answer",
+                document_id=self.document_id,
+                query=message,
+                answer=answer,
+                sources=sources,
+            )
+        except Exception:
+            traceback.print_exc()
 
     def can_generate_metrics(self) -> bool:
-        return False
+        return True
 
     async def _process_context(self, context: OpenAILLMContext):
         if not context.messages:
@@ -95,22 +149,84 @@ class LlamaIndexService(LLMService):
 
         message = context.messages[-1].get("content")
 
-        # Query the engine
-        response_txt = ""
-        streaming_response = await self.query_engine.aquery(message)
+        # Look for a cached answer while retrieving, in case there is none
+        await self.start_ttfb_metrics()
+        lookup = asyncio.create_task(self.lookup_answer(message))
+        retrieval = asyncio.create_task(self.retrieve(message))
+        try:
+            cached = await lookup
+        except BaseException:
+            retrieval.cancel()
+            raise
+
+        # Replay a cached answer to the same question
+        if cached:
+            retrieval.cancel()
+            await self.stop_ttfb_metrics()
+            self.timer.mark("first_token")
+            await self.push_frame(LLMTextFrame(cached["answer"]))
+            await self._push_citations(cached["sources"])
+            return
+
+        nodes = await retrieval
+        self.timer.mark("retrieval_done")
+        query_bundle = QueryBundle(message)
+
+        # Generate the answer
+        streaming_response = await self.query_engine.asynthesize(query_bundle, nodes)
+
+        # Send each citation as soon as its marker is complete
+        parts: list[str] = []
+        cited: set[int] = set()
+        sources: list[str] = []
+        parser = CitationParser()
         async for response in streaming_response.response_gen:
+            if not parts:
+                await self.stop_ttfb_metrics()
+                self.timer.mark("first_token")
             await self.push_frame(LLMTextFrame(response))
-            response_txt += response
-
-        # Get the citations
-        citations = list(map(int, re.findall(r"\[(\d+)\]", response_txt)))
-        if not citations:
+            parts.append(response)
+
+            _, citations = parser.feed(response)
+            new = False
+            for i in citations:
+                # Skip repeated citations and sources that don't exist
+                if i in cited or not 1 <= i <= len(streaming_response.source_nodes):
+                    continue
+                cited.add(i)
+                sources.append(streaming_response.source_nodes[i-1].node.text)
+                new = True
+            if new:
+                await self._push_citations(sources)
+
+        answer = "".join(parts)
+        await self._report_usage(message, streaming_response.source_nodes, answer)
+
+        # Cache the answer for the next time
+        await self.store_answer(message, answer, sources)
+
+    async def _report_usage(self, message: str, source_nodes: List[NodeWithScore], answer: str):
+        # The streamed response doesn't report its usage, so the tokens are estimated
+        # with tiktoken. The prompt holds the question and the numbered sources.
+        prompt_tokens = self._estimate_tokens(message) + sum(
+            self._estimate_tokens(node.node.get_content()) for node in source_nodes
+        )
+        completion_tokens = self._estimate_tokens(answer)
+        self.timer.tokens = {"prompt": prompt_tokens, "completion": completion_tokens}
+        await self.start_llm_usage_metrics(LLMTokenUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        ))
+
+    async def _push_citations(self, sources: list[str]):
+        if not sources:
             return
 
         # Return the citations
         model = RTVICitationsMessage(
             data={
-                "sources": [streaming_response.source_nodes[i-1].node.text for i in citations]
+                "sources": sources
             }
         )
         await self.push_frame(
@@ -135,4 +251,4 @@ class LlamaIndexService(LLMService):
             await self.push_frame(LLMFullResponseEndFrame())
 
     def _estimate_tokens(self, text: str) -> int:
-        return 1
\ No newline at end of file
+        return len(self.encoding.encode(text))
\ No newline at end of file
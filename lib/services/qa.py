@@ -0,0 +1,214 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Tuple
+from lib.citations import CitationParser
+from lib.lexical import VECTOR
+
+# Llama Index
+from lib.engines.citated_query_engine import CitatedQueryEngine
+from llama_index.core.query_engine.citation_query_engine import CITATION_QA_TEMPLATE
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.llms.openai import OpenAI
+
+if TYPE_CHECKING:
+    from lib.index import LlamaIndex
+
+# Same model as the voice bots
+LLM_MODEL = "gpt-4"
+LLM_TEMPERATURE = 0.5
+
+# Questions answered at the same time
+DEFAULT_CONCURRENCY = 8
+
+# Query engines kept warm, one per document
+ENGINE_CACHE_SIZE = 16
+
+# Chat history settings
+HISTORY_TURNS = 4
+HISTORY_TTL = 30 * 60
+MAX_SESSIONS = 1024
+
+def create_llm() -> OpenAI:
+    return OpenAI(model=LLM_MODEL, temperature=LLM_TEMPERATURE)
+
+def normalize(question: str) -> str:
+    return " ".join(question.lower().split())
+
+def get_sources(nodes: List[NodeWithScore], citations: List[int]) -> tuple[List[int], List[str]]:
+    # Skip repeated citations and sources that don't exist
+    cited: List[int] = []
+    for i in citations:
+        if i not in cited and 1 <= i <= len(nodes):
+            cited.append(i)
+    return cited, [nodes[i - 1].node.text for i in cited]
+
+def with_history(question: str, turns: List[Tuple[str, str]]) -> str:
+    # Earlier turns give the LLM the context of follow-up questions
+    if not turns:
+        return question
+    history = "\n".join(f"User: {q}\nAssistant: {a}" for q, a in turns)
+    return f"Conversation so far:\n{history}\n\nQuestion: {question}"
+
+@dataclass
+class ChatSession:
+    document_id: str
+    turns: List[Tuple[str, str]] = field(default_factory=list)
+    updated_at: float = field(default_factory=time.time)
+
+class ChatHistory:
+    """Last few turns of each chat session, dropped after inactivity."""
+
+    def __init__(self, turns: int = HISTORY_TURNS, ttl: int = HISTORY_TTL, size: int = MAX_SESSIONS):
+        self.max_turns = turns
+        self.ttl = ttl
+        self.size = size
+        self.sessions: OrderedDict[str, ChatSession] = OrderedDict()
+
+    def get(self, session_id: str, document_id: str) -> List[Tuple[str, str]]:
+        session = self.sessions.get(session_id)
+        if not session or session.document_id != document_id or time.time() - session.updated_at > self.ttl:
+            return []
+        return list(session.turns)
+
+    def append(self, session_id: str, document_id: str, question: str, answer: str):
+        session = self.sessions.get(session_id)
+        if not session or session.document_id != document_id:
+            session = ChatSession(document_id)
+        session.turns = [*self.get(session_id, document_id), (question, answer)][-self.max_turns:]
+        session.updated_at = time.time()
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.size:
+            self.sessions.popitem(last=False)
+
+class QAService:
+    """Answers questions about a document inside the API process."""
+
+    def __init__(
+        self,
+        llama_index: "LlamaIndex",
+        concurrency: int = DEFAULT_CONCURRENCY,
+        mode: str = VECTOR,
+        top_k: int = 3,
+    ):
+        self.llama_index = llama_index
+        self.mode = mode
+        self.top_k = top_k
+        self.llm = create_llm()
+
+        # Shared by all requests, to bound the load on the LLM
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+        # Warm query engines, dropped when a document is re-indexed. The
+        # listeners run on the ingestion threads, hence the lock.
+        self.engines: OrderedDict[Tuple[str, bool], CitatedQueryEngine] = OrderedDict()
+        self.engines_lock = threading.Lock()
+        llama_index.listeners.append(self.invalidate)
+
+        self.history = ChatHistory()
+
+    def invalidate(self, document_id: str):
+        with self.engines_lock:
+            for key in [key for key in self.engines if key[0] == document_id]:
+                self.engines.pop(key, None)
+
+    def get_engine(self, document_id: str, streaming: bool = False) -> CitatedQueryEngine:
+        key = (document_id, streaming)
+        with self.engines_lock:
+            engine = self.engines.get(key)
+            if engine is None:
+                engine = self.engines[key] = self.create_engine(document_id, streaming)
+            self.engines.move_to_end(key)
+            while len(self.engines) > ENGINE_CACHE_SIZE:
+                self.engines.popitem(last=False)
+            return engine
+
+    def create_engine(self, document_id: str, streaming: bool = False) -> CitatedQueryEngine:
+        retriever = self.llama_index.as_retriever(document_id, self.top_k, self.mode)
+        return CitatedQueryEngine.from_args(
+            index=None,
+            retriever=retriever,
+            llm=self.llm,
+            citation_chunk_size=256,
+            citation_qa_template=CITATION_QA_TEMPLATE,
+            output_cls=None,
+            streaming=streaming,
+        )
+
+    async def answer(self, engine: CitatedQueryEngine, question: str, nodes: List[NodeWithScore]) -> Dict[str, Any]:
+        response = await engine.asynthesize(QueryBundle(question), nodes)
+
+        # Strip the citation markers from the answer
+        parser = CitationParser()
+        answer, citations = parser.feed(str(response))
+        citations, sources = get_sources(response.source_nodes, citations)
+        return {
+            "answer": answer + parser.flush(),
+            "citations": citations,
+            "sources": sources,
+        }
+
+    async def batch_query(self, document_id: str, questions: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        engine = self.get_engine(document_id)
+
+        # Identical questions share their retrieval
+        retrievals: dict[str, asyncio.Task] = {}
+        def retrieve(question: str) -> asyncio.Task:
+            key = normalize(question)
+            if key not in retrievals:
+                retrievals[key] = asyncio.create_task(
+                    asyncio.to_thread(engine.retrieve, QueryBundle(question))
+                )
+            return retrievals[key]
+
+        async def run(index: int, question: str) -> Dict[str, Any]:
+            async with self.semaphore:
+                try:
+                    nodes = await asyncio.shield(retrieve(question))
+                    return {"index": index, "question": question, **await self.answer(engine, question, nodes)}
+                except Exception as e:
+                    return {"index": index, "question": question, "error": str(e)}
+
+        # Return the answers as they finish
+        tasks = [asyncio.create_task(run(i, question)) for i, question in enumerate(questions)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in [*tasks, *retrievals.values()]:
+                task.cancel()
+
+    async def chat(self, document_id: str, session_id: str, question: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        engine = self.get_engine(document_id, streaming=True)
+        turns = self.history.get(session_id, document_id)
+
+        parts: List[str] = []
+        citations: List[int] = []
+        async with self.semaphore:
+            # Retrieve for the question alone, answer with the conversation
+            nodes = await asyncio.to_thread(engine.retrieve, QueryBundle(question))
+            response = await engine.asynthesize(QueryBundle(with_history(question, turns)), nodes)
+
+            # Stream the text without the markers, and the citations as they appear
+            parser = CitationParser()
+            async for token in response.response_gen:
+                text, found = parser.feed(token)
+                if text:
+                    parts.append(text)
+                    yield "token", {"text": text}
+
+                cited, sources = get_sources(response.source_nodes, citations + found)
+                if len(cited) > len(citations):
+                    citations = cited
+                    yield "citations", {"citations": citations, "sources": sources}
+
+            if rest := parser.flush():
+                parts.append(rest)
+                yield "token", {"text": rest}
+
+        answer = "".join(parts)
+        self.history.append(session_id, document_id, question, answer)
+        yield "done", {"session_id": session_id, "answer": answer, "citations": citations}
@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import socket
+import traceback
+import lib.helpers as helpers
+from lib.answers import AnswerCache, DEFAULT_THRESHOLD, DEFAULT_TTL, DEFAULT_SIZE
+from lib.lexical import VECTOR, LEXICAL
+from lib.metrics import Registry
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from llama_index.core import Settings
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+# Bots don't need to import the indexing code
+if TYPE_CHECKING:
+    from lib.index import LlamaIndex
+
+# Socket configuration
+DEFAULT_SOCKET_PATH = "codex.sock"
+STREAM_LIMIT = 64 * 1024 * 1024
+
+def get_socket_path() -> str:
+    return os.environ.get("RETRIEVAL_SOCKET", DEFAULT_SOCKET_PATH)
+
+class RetrievalServer:
+    """Serves retrieval from the index loaded by the API process over a Unix socket."""
+
+    def __init__(self, llama_index: "LlamaIndex", metrics: Registry, path: Optional[str] = None):
+        self.llama_index = llama_index
+        self.metrics = metrics
+        self.path = path or get_socket_path()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.mode = os.environ.get("RETRIEVAL_MODE", VECTOR)
+
+        # Answers shared by all bots, dropped when a document is re-indexed
+        self.answers = AnswerCache(
+            threshold=helpers.get_float("ANSWER_CACHE_THRESHOLD", DEFAULT_THRESHOLD),
+            ttl=helpers.get_int("ANSWER_CACHE_TTL", DEFAULT_TTL),
+            size=helpers.get_int("ANSWER_CACHE_SIZE", DEFAULT_SIZE),
+        )
+        llama_index.listeners.append(self.answers.invalidate)
+
+        # Request handlers
+        self.handlers = {
+            "retrieve": self.retrieve,
+            "lookup_answer": self.lookup_answer,
+            "store_answer": self.store_answer,
+            "answer_stats": self.answer_stats,
+            "observe_turn": self.observe_turn,
+        }
+
+    async def start(self):
+        # Remove the socket of a previous run
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self.handle, path=self.path, limit=STREAM_LIMIT)
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                try:
+                    handler = self.handlers[request["op"]]
+                    response = {"data": await handler(**request.get("args", {}))}
+                except Exception as e:
+                    traceback.print_exc()
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def retrieve(self, document_id: str, query: str, top_k: int, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+        retriever = self.llama_index.as_retriever(document_id, top_k, mode or self.mode)
+        nodes = await asyncio.to_thread(retriever.retrieve, query)
+        return [{"node": doc_to_json(n.node), "score": n.score} for n in nodes]
+
+    async def embed_query(self, query: str) -> Optional[list[float]]:
+        # Lexical retrieval never embeds the question, so neither does the answer cache
+        if self.mode == LEXICAL:
+            return None
+
+        # Query embeddings go through the embedding cache
+        return await asyncio.to_thread(Settings.embed_model.get_query_embedding, query)
+
+    async def lookup_answer(self, document_id: str, query: str) -> Optional[Dict[str, Any]]:
+        embedding = await self.embed_query(query)
+        answer = self.answers.lookup(document_id, query, embedding)
+        if not answer:
+            return None
+        return {"answer": answer.answer, "sources": answer.sources}
+
+    async def store_answer(self, document_id: str, query: str, answer: str, sources: List[str]):
+        embedding = await self.embed_query(query)
+        self.answers.store(document_id, query, embedding, answer, sources)
+
+    async def answer_stats(self) -> Dict[str, Any]:
+        return self.answers.stats()
+
+    async def observe_turn(self, durations: Dict[str, float], tokens: Dict[str, int]):
+        # Aggregate the timings reported by the bots
+        self.metrics.observe_turn(durations, tokens)
+
+class RetrievalClient:
+    """Client of the retrieval server used by the bots."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or get_socket_path()
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, op: str, **args: Any) -> Any:
+        async with self.lock:
+            # Reconnect if the server was restarted
+            for attempt in range(2):
+                try:
+                    if not self.writer or self.writer.is_closing():
+                        self.reader, self.writer = await asyncio.open_unix_connection(self.path, limit=STREAM_LIMIT)
+                    self.writer.write(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+                    await self.writer.drain()
+                    line = await self.reader.readline()
+                    if not line:
+                        raise ConnectionError("Retrieval server closed the connection.")
+                    break
+                except ConnectionError:
+                    self.writer = None
+                    if attempt:
+                        raise
+                except BaseException:
+                    # A cancelled request may still have a response in flight
+                    if self.writer:
+                        self.writer.close()
+                    self.writer = None
+                    raise
+
+        response = json.loads(line)
+        if "error" in response:
+            raise Exception(response["error"])
+        return response["data"]
+
+    def request_sync(self, op: str, **args: Any) -> Any:
+        # Blocking request on a short-lived connection
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.path)
+            sock.sendall(json.dumps({"op": op, "args": args}).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                response = json.loads(f.readline())
+        if "error" in response:
+            raise Exception(response["error"])
+        return response["data"]
+
+class RemoteRetriever(BaseRetriever):
+    """Retriever that queries the retrieval server for a single document."""
+
+    def __init__(self, client: RetrievalClient, document_id: str, top_k: int = 3, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.client = client
+        self.document_id = document_id
+        self.top_k = top_k
+
+    def _to_nodes(self, data: List[Dict[str, Any]]) -> List[NodeWithScore]:
+        return [NodeWithScore(node=json_to_doc(n["node"]), score=n["score"]) for n in data]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._to_nodes(self.client.request_sync(
+            "retrieve", document_id=self.document_id, query=query_bundle.query_str, top_k=self.top_k
+        ))
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._to_nodes(await self.client.request(
+            "retrieve", document_id=self.document_id, query=query_bundle.query_str, top_k=self.top_k
+        ))
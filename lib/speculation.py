@@ -0,0 +1,58 @@
+import re
+import time
+from difflib import SequenceMatcher
+from typing import Optional, Protocol
+
+from pipecat.frames.frames import (
+    Frame,
+    InterimTranscriptionFrame,
+    TranscriptionFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+def normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+def similarity(a: str, b: str) -> float:
+    return SequenceMatcher(None, normalize(a), normalize(b)).ratio()
+
+class Prefetcher(Protocol):
+    def prefetch(self, text: str): ...
+
+class SpeculativeRetrievalProcessor(FrameProcessor):
+    """Starts retrieval early once the interim transcripts stop changing."""
+
+    def __init__(self, prefetcher: Prefetcher, stable_ms: int = 300, **kwargs):
+        super().__init__(**kwargs)
+        self.prefetcher = prefetcher
+        self.stable_ms = stable_ms
+
+        # Last interim transcript and when it was first seen
+        self.text: Optional[str] = None
+        self.since = 0.0
+
+    def speculate(self):
+        if self.text and normalize(self.text):
+            self.prefetcher.prefetch(self.text)
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, InterimTranscriptionFrame):
+            now = time.monotonic()
+            if self.text and normalize(frame.text) == normalize(self.text):
+                # Same transcript again, retrieve if it held long enough
+                if (now - self.since) * 1000 >= self.stable_ms:
+                    self.speculate()
+            else:
+                self.text = frame.text
+                self.since = now
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            # The final transcript is about to come
+            self.speculate()
+        elif isinstance(frame, (TranscriptionFrame, UserStartedSpeakingFrame)):
+            self.text = None
+
+        await self.push_frame(frame, direction)
@@ -0,0 +1,563 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from pydantic import PrivateAttr
+from lib.helpers import get_int
+from lib.ann import IVFIndex, DEFAULT_NPROBE, DEFAULT_MIN_VECTORS
+from lib.quantization import QuantizedMatrix, NONE, RESCORE_FACTOR, MIN_CANDIDATES
+
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.index_store.keyval_index_store import KVIndexStore
+from llama_index.core.storage.kvstore.types import (
+    BaseKVStore,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_COLLECTION,
+)
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    FilterOperator,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import (
+    metadata_dict_to_node,
+    node_to_metadata_dict,
+)
+
+# Storage configuration
+STORAGE_DIR = "storage"
+DATABASE_PATH = os.path.join(STORAGE_DIR, "index.db")
+ANN_DIR = os.path.join(STORAGE_DIR, "ann")
+QUANTIZED_DIR = os.path.join(STORAGE_DIR, "quantized")
+INDEX_ID = "vector_index"
+
+# Compact once this share of the database file is unused
+COMPACT_THRESHOLD = 0.25
+
+class SQLiteDatabase:
+    """SQLite database shared by the index stores, with a connection per thread."""
+
+    def __init__(self, path: str = DATABASE_PATH):
+        self.path = path
+        self.local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        with self.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (collection, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS nodes ("
+                "id TEXT PRIMARY KEY, document_id TEXT NOT NULL, "
+                "embedding BLOB NOT NULL, node TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS nodes_document_id ON nodes (document_id)")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Autocommit mode, transactions are handled explicitly
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.depth = 0
+            self.local.callbacks = []
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # Nested transactions join the outermost one
+        conn = self.conn
+        if self.local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self.local.depth += 1
+        try:
+            yield conn
+        except BaseException:
+            self.local.depth -= 1
+            if self.local.depth == 0:
+                self.local.callbacks = []
+                conn.execute("ROLLBACK")
+            raise
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            conn.execute("COMMIT")
+            callbacks, self.local.callbacks = self.local.callbacks, []
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback: Callable[[], None]):
+        # Run once the outermost transaction commits, so that other threads
+        # can't read the rows it replaces anymore, or now outside of one
+        if getattr(self.local, "depth", 0) == 0:
+            callback()
+        else:
+            self.local.callbacks.append(callback)
+
+    def compact(self, force: bool = False):
+        # Fold the write-ahead log back into the database
+        conn = self.conn
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        # Reclaim the space of deleted rows if there is enough of it
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if force or (page_count and freelist_count / page_count > COMPACT_THRESHOLD):
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+class SQLiteKVStore(BaseKVStore):
+    """Key-value store for the docstore and the index store."""
+
+    def __init__(self, db: SQLiteDatabase):
+        self.db = db
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    def put_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                [(collection, key, json.dumps(val)) for key, val in kv_pairs]
+            )
+
+    async def aput_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.put_all(kv_pairs, collection, batch_size)
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        row = self.db.conn.execute(
+            "SELECT value FROM kv WHERE collection = ? AND key = ?", (collection, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        rows = self.db.conn.execute(
+            "SELECT key, value FROM kv WHERE collection = ?", (collection,)
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key)
+            )
+        return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+def get_document_ids(filters: Optional[MetadataFilters]) -> Optional[set[str]]:
+    # Only filtering by the document ID is supported
+    if not filters or not filters.filters:
+        return None
+
+    document_ids: Optional[set[str]] = None
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters) or f.key != "id_":
+            raise ValueError("Only filters on 'id_' are supported.")
+        if f.operator == FilterOperator.EQ:
+            values = {f.value}
+        elif f.operator == FilterOperator.IN:
+            values = set(f.value)
+        else:
+            raise ValueError(f"Unsupported filter operator: {f.operator}")
+        document_ids = values if document_ids is None else document_ids & values
+    return document_ids
+
+class Partition:
+    """Embeddings of a single document."""
+
+    def __init__(self, ids: List[str], matrix: np.ndarray, ivf: Optional[IVFIndex] = None):
+        self.ids = ids
+        self.matrix = matrix
+        self.norms = np.maximum(np.linalg.norm(matrix, axis=1), 1e-10)
+        self.ivf = ivf
+
+    def mask(self, similarities: np.ndarray, node_ids: Optional[set[str]], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if node_ids is None:
+            return similarities
+        ids = self.ids if rows is None else [self.ids[i] for i in rows]
+        mask = np.array([i in node_ids for i in ids], dtype=bool)
+        return np.where(mask, similarities, -np.inf)
+
+    def search(self, query: np.ndarray, k: int, node_ids: Optional[set[str]] = None) -> List[Tuple[float, str]]:
+        # Approximate search if the partition has an IVF index
+        if self.ivf and node_ids is None:
+            rows, similarities = self.ivf.search(self.matrix, self.norms, query, k)
+            return [(float(s), self.ids[i]) for i, s in zip(rows, similarities)]
+
+        # Cosine similarity, the query is already normalized
+        similarities = self.mask(self.matrix @ query / self.norms, node_ids)
+
+        k = min(k, len(self.ids))
+        if k == 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        return [
+            (float(similarities[i]), self.ids[i])
+            for i in top if similarities[i] != -np.inf
+        ]
+
+class QuantizedPartition(Partition):
+    """Quantized embeddings of a single document, memory-mapped from disk.
+
+    Candidates are picked with the quantized embeddings and rescored with
+    the full precision ones from the database, so the results match the
+    exact search as long as the true top k are among the candidates.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        quantized: QuantizedMatrix,
+        get_embeddings: Callable[[List[str]], np.ndarray],
+        ivf: Optional[IVFIndex] = None,
+    ):
+        self.ids = ids
+        self.quantized = quantized
+        self.get_embeddings = get_embeddings
+        self.ivf = ivf
+
+    def search(self, query: np.ndarray, k: int, node_ids: Optional[set[str]] = None) -> List[Tuple[float, str]]:
+        rows = self.ivf.probe(query) if self.ivf and node_ids is None else None
+        similarities = self.mask(self.quantized.similarities(query, rows), node_ids, rows)
+
+        n = min(len(similarities), max(k * RESCORE_FACTOR, MIN_CANDIDATES))
+        if n == 0 or k == 0:
+            return []
+        top = np.argpartition(-similarities, n - 1)[:n]
+        top = top[similarities[top] != -np.inf]
+        if rows is not None:
+            top = rows[top]
+        candidates = [self.ids[i] for i in top]
+        if not candidates:
+            return []
+
+        # Rescore the candidates exactly
+        matrix = self.get_embeddings(candidates)
+        exact = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1), 1e-10)
+        k = min(k, len(candidates))
+        best = np.argpartition(-exact, k - 1)[:k]
+        return [(float(exact[i]), candidates[i]) for i in best]
+
+class SQLiteVectorStore(BasePydanticVectorStore):
+    """Vector store that appends nodes and embeddings to SQLite.
+
+    Embeddings are partitioned by document and loaded on demand, so a query
+    filtered by document only searches that document's embeddings. With the
+    "ivf" search mode, large partitions are searched with an IVF index.
+    With quantization, partitions are memory-mapped float16 or int8 copies
+    of the embeddings, and only the candidates are rescored in full precision.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    max_partitions: Optional[int] = None
+    search_mode: str = "exact"
+    nlist: int = 0
+    nprobe: int = DEFAULT_NPROBE
+    min_ann_vectors: int = DEFAULT_MIN_VECTORS
+    quantization: str = NONE
+
+    _db: SQLiteDatabase = PrivateAttr()
+    _partitions: "OrderedDict[str, Partition]" = PrivateAttr(default_factory=OrderedDict)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+    # Bumped when the nodes of a document change, to detect stale reads
+    _generations: Dict[str, int] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, db: SQLiteDatabase, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._db = db
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SQLiteVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return self._db
+
+    def list_partitions(self) -> List[str]:
+        rows = self._db.conn.execute("SELECT DISTINCT document_id FROM nodes").fetchall()
+        return [document_id for document_id, in rows]
+
+    def loaded_partitions(self) -> List[str]:
+        return list(self._partitions.keys())
+
+    def get_generation(self, document_id: str) -> int:
+        with self._lock:
+            return self._generations.get(document_id, 0)
+
+    def load_partition(self, document_id: str) -> Optional[Partition]:
+        with self._lock:
+            partition = self._partitions.get(document_id)
+            if partition:
+                self._partitions.move_to_end(document_id)
+                return partition
+            generation = self._generations.get(document_id, 0)
+
+        if self.quantization == NONE:
+            partition = self.read_partition(document_id)
+        else:
+            partition = self.read_quantized_partition(document_id)
+        if not partition:
+            return None
+
+        with self._lock:
+            # Not kept if a write dropped the partition while it was read
+            if self._generations.get(document_id, 0) != generation:
+                return partition
+            self._partitions[document_id] = partition
+            # Unload the least recently used partitions
+            while self.max_partitions and len(self._partitions) > self.max_partitions:
+                self._partitions.popitem(last=False)
+        return partition
+
+    def read_embeddings(self, document_id: str) -> Tuple[List[str], Optional[np.ndarray]]:
+        rows = self._db.conn.execute(
+            "SELECT id, embedding FROM nodes WHERE document_id = ? ORDER BY id", (document_id,)
+        ).fetchall()
+        if not rows:
+            return [], None
+        ids = [node_id for node_id, _ in rows]
+        return ids, np.stack([np.frombuffer(embedding, dtype=np.float32) for _, embedding in rows])
+
+    def get_embeddings(self, node_ids: List[str]) -> np.ndarray:
+        placeholders = ",".join("?" * len(node_ids))
+        rows = dict(self._db.conn.execute(
+            f"SELECT id, embedding FROM nodes WHERE id IN ({placeholders})", node_ids
+        ).fetchall())
+        return np.stack([np.frombuffer(rows[node_id], dtype=np.float32) for node_id in node_ids])
+
+    def load_ivf(self, document_id: str, ids: List[str]) -> Optional[IVFIndex]:
+        # IVF indexes are trained at ingestion, queries only load them
+        if self.search_mode != "ivf":
+            return None
+        return IVFIndex.load(self.get_ann_path(document_id), ids, self.nprobe)
+
+    def build_ivf(self, document_id: str):
+        # Train the IVF index of a document again after its nodes changed
+        path = self.get_ann_path(document_id)
+        if os.path.exists(path):
+            os.remove(path)
+        if self.search_mode == "ivf":
+            ids, matrix = self.read_embeddings(document_id)
+            if matrix is not None and len(ids) >= self.min_ann_vectors:
+                IVFIndex.train(matrix, self.nlist, self.nprobe).save(path, ids)
+
+        # Queries that loaded the partition without the index load it again
+        self.unload_partition(document_id)
+
+    def read_partition(self, document_id: str) -> Optional[Partition]:
+        ids, matrix = self.read_embeddings(document_id)
+        if matrix is None:
+            return None
+        return Partition(ids, matrix, self.load_ivf(document_id, ids))
+
+    def read_quantized_partition(self, document_id: str) -> Optional[Partition]:
+        while True:
+            generation = self.get_generation(document_id)
+            ids = [node_id for node_id, in self._db.conn.execute(
+                "SELECT id FROM nodes WHERE document_id = ? ORDER BY id", (document_id,)
+            ).fetchall()]
+            if not ids:
+                return None
+
+            # Quantize the embeddings again if a write dropped them or the kind changed
+            path = self.get_quantized_path(document_id)
+            quantized = QuantizedMatrix.load(path, ids)
+            if quantized is None or quantized.kind != self.quantization:
+                ids, matrix = self.read_embeddings(document_id)
+                if matrix is None:
+                    return None
+                try:
+                    QuantizedMatrix.quantize(matrix, self.quantization).save(path, ids)
+                except FileNotFoundError:
+                    # A write removed the directory while the files were saved
+                    continue
+                if self.get_generation(document_id) != generation:
+                    # Saved from the rows that a write replaced in the meantime
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                quantized = QuantizedMatrix.load(path, ids)
+                if quantized is None:
+                    return None
+
+            ivf = self.load_ivf(document_id, ids)
+            return QuantizedPartition(ids, quantized, self.get_embeddings, ivf)
+
+    def get_ann_path(self, document_id: str) -> str:
+        return os.path.join(ANN_DIR, f"{document_id}.npz")
+
+    def get_quantized_path(self, document_id: str) -> str:
+        return os.path.join(QUANTIZED_DIR, document_id)
+
+    def unload_partition(self, document_id: str):
+        with self._lock:
+            self._generations[document_id] = self._generations.get(document_id, 0) + 1
+            self._partitions.pop(document_id, None)
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        rows = []
+        for node in nodes:
+            embedding = np.asarray(node.get_embedding(), dtype=np.float32)
+            document_id = node.metadata.get("id_") or node.ref_doc_id
+            content = node_to_metadata_dict(node, remove_text=False, flat_metadata=False)
+            rows.append((node.node_id, document_id, embedding.tobytes(), json.dumps(content)))
+
+        # Append the new rows in a single transaction
+        with self._db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO nodes (id, document_id, embedding, node) VALUES (?, ?, ?, ?)",
+                rows
+            )
+
+        # Changed partitions are rebuilt on the next query, since the node IDs
+        # are stable and can't tell that an embedding changed. They are dropped
+        # once the enclosing transaction commits, or queries could rebuild them
+        # from the rows it replaces.
+        for document_id in {document_id for _, document_id, _, _ in rows}:
+            self._db.after_commit(lambda document_id=document_id: self.drop_partition(document_id))
+        return [node.node_id for node in nodes]
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        with self._db.transaction() as conn:
+            conn.execute("DELETE FROM nodes WHERE document_id = ?", (ref_doc_id,))
+            self._db.after_commit(lambda: self.drop_partition(ref_doc_id))
+
+    def drop_partition(self, document_id: str):
+        # Queries saving files from older rows see the change and remove them
+        self.unload_partition(document_id)
+
+        # Drop the IVF index and the quantized embeddings of the document
+        path = self.get_ann_path(document_id)
+        if os.path.exists(path):
+            os.remove(path)
+        shutil.rmtree(self.get_quantized_path(document_id), ignore_errors=True)
+
+        # Queries that loaded the removed files in the meantime don't keep them
+        self.unload_partition(document_id)
+
+    def get_nodes_by_id(self, node_ids: List[str]) -> List[BaseNode]:
+        placeholders = ",".join("?" * len(node_ids))
+        rows = self._db.conn.execute(
+            f"SELECT id, node FROM nodes WHERE id IN ({placeholders})", node_ids
+        ).fetchall()
+        nodes = {node_id: metadata_dict_to_node(json.loads(content)) for node_id, content in rows}
+        return [nodes[node_id] for node_id in node_ids if node_id in nodes]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.query_embedding is None:
+            raise ValueError("Query embedding is required.")
+
+        # Only search the partitions of the requested documents
+        document_ids = get_document_ids(query.filters)
+        if query.doc_ids:
+            document_ids = set(query.doc_ids) if document_ids is None else document_ids & set(query.doc_ids)
+        if document_ids is None:
+            document_ids = set(self.list_partitions())
+        node_ids = set(query.node_ids) if query.node_ids else None
+
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-10)
+
+        candidates: List[Tuple[float, str]] = []
+        for document_id in document_ids:
+            partition = self.load_partition(document_id)
+            if partition:
+                candidates.extend(partition.search(q, query.similarity_top_k, node_ids))
+        candidates.sort(reverse=True)
+        candidates = candidates[:query.similarity_top_k]
+
+        top_ids = [node_id for _, node_id in candidates]
+        return VectorStoreQueryResult(
+            nodes=self.get_nodes_by_id(top_ids) if top_ids else [],
+            similarities=[similarity for similarity, _ in candidates],
+            ids=top_ids,
+        )
+
+def get_vector_store_settings() -> Dict[str, Any]:
+    return {
+        "max_partitions": get_int("MAX_LOADED_PARTITIONS", 0) or None,
+        "search_mode": os.environ.get("VECTOR_SEARCH", "exact"),
+        "nlist": get_int("IVF_NLIST", 0),
+        "nprobe": get_int("IVF_NPROBE", DEFAULT_NPROBE),
+        "min_ann_vectors": get_int("ANN_MIN_VECTORS", DEFAULT_MIN_VECTORS),
+        "quantization": os.environ.get("VECTOR_QUANTIZATION", NONE),
+    }
+
+def create_storage_context(db: SQLiteDatabase) -> StorageContext:
+    kvstore = SQLiteKVStore(db)
+    return StorageContext.from_defaults(
+        docstore=KVDocumentStore(kvstore),
+        index_store=KVIndexStore(kvstore),
+        vector_store=SQLiteVectorStore(db, **get_vector_store_settings()),
+    )
+
+def migrate_legacy_storage(index: VectorStoreIndex):
+    # Copy an index persisted as JSON files into the database
+    legacy = load_index_from_storage(
+        StorageContext.from_defaults(persist_dir=STORAGE_DIR),
+        index_id=INDEX_ID
+    )
+    nodes = list(legacy.docstore.docs.values())
+    for node in nodes:
+        node.embedding = legacy.vector_store.get(node.node_id)
+    index.insert_nodes(nodes)
+    for document_id in {node.metadata.get("id_") or node.ref_doc_id for node in nodes}:
+        index.vector_store.build_ivf(document_id)
+
+def load_index(create: bool = True) -> VectorStoreIndex:
+    exists = os.path.exists(DATABASE_PATH)
+    if not exists and not create:
+        raise Exception("Index not found!")
+
+    legacy = not exists and os.path.exists(os.path.join(STORAGE_DIR, "docstore.json"))
+    db = SQLiteDatabase(DATABASE_PATH)
+    storage_context = create_storage_context(db)
+
+    # Load the index struct if it was created before
+    if storage_context.index_store.get_index_struct(INDEX_ID):
+        return load_index_from_storage(storage_context, index_id=INDEX_ID)
+
+    print("Creating index...")
+    index = VectorStoreIndex(nodes=[], storage_context=storage_context)
+    index.set_index_id(INDEX_ID)
+    if legacy:
+        print("Migrating index...")
+        migrate_legacy_storage(index)
+    return index
@@ -1,8 +1,10 @@
-import re
 from pydantic import BaseModel
 from typing import Any, Mapping, Optional
 
+from pipecat.frames.frames import Frame, LLMFullResponseEndFrame, LLMFullResponseStartFrame
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
 from pipecat.utils.text.base_text_filter import BaseTextFilter
+from lib.citations import CitationParser
 
 class CitationFilter(BaseTextFilter):
     """Removes citations from text in TextFrames."""
@@ -14,6 +16,8 @@ class CitationFilter(BaseTextFilter):
         super().__init__(**kwargs)
         self._settings = params
         self._interrupted = False
+        self._response_ended = False
+        self._parser = CitationParser()
 
     def update_settings(self, settings: Mapping[str, Any]):
         for key, value in settings.items():
@@ -22,11 +26,46 @@ class CitationFilter(BaseTextFilter):
 
     def filter(self, text: str) -> str:
         # Remove citations in the format [1], [2], etc.
-        filtered_text = re.sub(r"\[\d+\]", "", text)
+        # Markers split across chunks are removed once they are complete
+        filtered_text, _ = self._parser.feed(text)
+
+        # Nothing can complete a marker held back at the end of the response
+        if self._response_ended:
+            self._response_ended = False
+            filtered_text += self._parser.flush()
         return filtered_text
 
+    def start_response(self):
+        self._response_ended = False
+        self._parser.reset()
+
+    def end_response(self):
+        # The TTS filters the rest of the response after the end frame
+        self._response_ended = True
+
     def handle_interruption(self):
         self._interrupted = True
+        self._parser.reset()
 
     def reset_interruption(self):
-        self._interrupted = False
\ No newline at end of file
+        # Drop a marker held back from the interrupted response
+        if self._interrupted:
+            self._parser.reset()
+        self._interrupted = False
+
+class CitationFilterProcessor(FrameProcessor):
+    """Tells the citation filter of the TTS where each response starts and ends."""
+
+    def __init__(self, text_filter: CitationFilter, **kwargs):
+        super().__init__(**kwargs)
+        self.text_filter = text_filter
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, LLMFullResponseStartFrame):
+            self.text_filter.start_response()
+        elif isinstance(frame, LLMFullResponseEndFrame):
+            self.text_filter.end_response()
+
+        await self.push_frame(frame, direction)
@@ -0,0 +1,152 @@
+import os
+import asyncio
+import tempfile
+from hashlib import sha256
+from dataclasses import dataclass
+from typing import Optional
+from starlette.requests import Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Allowance for the multipart headers around an uploaded file
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+class InvalidUpload(Exception):
+    pass
+
+@dataclass
+class Upload:
+    digest: str
+    filename: str
+    content_type: str
+
+def write_chunk(f, hash, chunk: bytes):
+    # Both calls release the GIL for large buffers
+    hash.update(chunk)
+    f.write(chunk)
+
+class MultipartReceiver:
+    """Collects the data of a single file field while a multipart body is parsed."""
+
+    def __init__(self, boundary: bytes, field: str):
+        self.field = field
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+
+        # Headers of the current part
+        self.headers: dict[bytes, bytes] = dict()
+        self.header_field = b""
+        self.header_value = b""
+
+        # Data of the file received since the last take
+        self.in_file = False
+        self.data: list[bytes] = []
+
+        self.parser = MultipartParser(boundary, callbacks={
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        })
+
+    def feed(self, chunk: bytes) -> bytes:
+        try:
+            self.parser.write(chunk)
+        except MultipartParseError as e:
+            raise InvalidUpload(str(e))
+        data, self.data = b"".join(self.data), []
+        return data
+
+    def finish(self):
+        try:
+            self.parser.finalize()
+        except MultipartParseError as e:
+            raise InvalidUpload(str(e))
+
+    def on_part_begin(self):
+        self.headers = dict()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        # Only the first part of the field with a file name is kept
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if name == self.field and b"filename" in options and self.filename is None:
+            self.in_file = True
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+            content_type = self.headers.get(b"content-type")
+            self.content_type = content_type.decode("latin-1") if content_type else None
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.in_file:
+            self.data.append(data[start:end])
+
+    def on_part_end(self):
+        self.in_file = False
+
+async def receive_upload(request: Request, directory: str, max_size: int, field: str = "file") -> Upload:
+    # Parse the body as it arrives, writing the file to disk while hashing it,
+    # so that an upload is only stored once and stops as soon as it is too large
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise InvalidUpload("Expected a multipart form.")
+
+    # Reject uploads that announce their size early
+    max_body_size = max_size + MULTIPART_OVERHEAD
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_body_size:
+        raise UploadTooLarge()
+
+    receiver = MultipartReceiver(boundary, field)
+    hash = sha256()
+    size = 0
+    body_size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                # Chunked uploads have no length, so the body is counted too
+                body_size += len(chunk)
+                if body_size > max_body_size:
+                    raise UploadTooLarge()
+
+                data = receiver.feed(chunk)
+                if data:
+                    size += len(data)
+                    if size > max_size:
+                        raise UploadTooLarge()
+                    await asyncio.to_thread(write_chunk, f, hash, data)
+            receiver.finish()
+
+        if not receiver.filename:
+            raise InvalidUpload("No file provided.")
+
+        # Move the file to its content address atomically
+        digest = hash.hexdigest()
+        os.replace(tmp_path, os.path.join(directory, digest))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return Upload(
+        digest=digest,
+        filename=receiver.filename,
+        content_type=receiver.content_type or "application/octet-stream",
+    )
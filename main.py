@@ -1,43 +1,77 @@
 #!.env/bin/python3
 # -*- coding: utf-8 -*-
 
+# The commands moved to lib/cli.py, which runs them without the server
+if __name__ == "__main__":
+    raise SystemExit("The commands moved, use: python -m lib.cli {reset,reindex,compact,verify}")
+
 import os
-import subprocess
-from hashlib import sha256
+import json
+import uuid
 from lib.index import LlamaIndex
 from typing import Annotated, Any, Dict
 from contextlib import asynccontextmanager
 from pydantic import ValidationError
 import lib.helpers as helpers
-from lib.models import sqlite_url, connect_args, Documents
-from lib.manager import ConnectionManager
+from lib.embeddings import use_embedding_cache, DEFAULT_CACHE_SIZE
+from lib.database import Database, DEFAULT_POOL_SIZE
+from lib.models import Documents, Jobs, JobState, BatchQuery, ChatQuery
+from lib.manager import ConnectionManager, Overloaded
+from lib.ingestion import IngestionQueue
+from lib.services.retrieval import RetrievalServer
+from lib.services.qa import QAService, DEFAULT_CONCURRENCY
+from lib.metrics import Registry
+from lib.uploads import receive_upload, InvalidUpload, UploadTooLarge
 
 # FastAPI
 from sqlalchemy.exc import IntegrityError
-from sqlmodel import SQLModel, Session, create_engine
-from fastapi import FastAPI, Request, BackgroundTasks, Depends, File, HTTPException, UploadFile
+from sqlmodel.ext.asyncio.session import AsyncSession
+from fastapi import FastAPI, Request, BackgroundTasks, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
+# Tools
+helpers.set_env()
+
 # Database configuration
-engine = create_engine(sqlite_url, connect_args=connect_args)
-def get_session():
-    with Session(engine) as session:
+database = Database(pool_size=helpers.get_int("DATABASE_POOL_SIZE", DEFAULT_POOL_SIZE))
+async def get_session():
+    async with database.session() as session:
         yield session
-SessionDep = Annotated[Session, Depends(get_session)]
+SessionDep = Annotated[AsyncSession, Depends(get_session)]
 
-# Tools
-helpers.set_env()
+max_upload_size = helpers.get_int("MAX_UPLOAD_SIZE", 200 * 1024 * 1024)
+use_embedding_cache(max_size=helpers.get_int("EMBEDDING_CACHE_SIZE", DEFAULT_CACHE_SIZE))
 llama_index = LlamaIndex()
 manager = ConnectionManager()
+ingestion = IngestionQueue(
+    database,
+    llama_index,
+    workers=helpers.get_int("INGESTION_WORKERS", os.cpu_count() or 1),
+)
+metrics = Registry()
+retrieval = RetrievalServer(llama_index, metrics)
+qa = QAService(
+    llama_index,
+    concurrency=helpers.get_int("QA_CONCURRENCY", DEFAULT_CONCURRENCY),
+    mode=retrieval.mode,
+)
 
 # Startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    SQLModel.metadata.create_all(engine)
+    await database.start()
     os.makedirs("uploads", exist_ok=True)
+    await ingestion.start()
+    await retrieval.start()
+    await manager.start()
     yield
-    manager.terminate_processes()
+    await retrieval.stop()
+    ingestion.shutdown()
+    await database.close()
+    await manager.close()
+    await manager.terminate_processes()
     print("ʕ·͡ᴥ·ʔ﻿ Goodbye!")
 
 # Initialize the application
@@ -65,42 +99,36 @@ app.add_middleware(
 async def check():
     return {"status": "ok"}
 
-@app.post("/upload")
-async def upload(
-    background_tasks: BackgroundTasks,
-    session: SessionDep,
-    file: UploadFile = File(...),
-):
-    # Check if we have a file
-    if not file or not file.filename:
-        raise HTTPException(status_code=400, detail="No file provided.")
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    metrics.set_answer_cache_stats(retrieval.answers.stats())
+    return metrics.render()
 
-    # Save the file in the background
-    content = await file.read()
-
-    # Calculate the hash of the content
-    hash = sha256(content).hexdigest()
+@app.post("/upload")
+async def upload(request: Request):
+    # Stream the file to disk while calculating its hash
+    try:
+        upload = await receive_upload(request, "uploads", max_upload_size)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail="File too large.")
+    except InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    hash = upload.digest
 
     # Validate the document
     try:
         document = Documents(
             id=hash,
-            filename=file.filename,
-            content_type=file.content_type or "application/octet-stream",
+            filename=upload.filename,
+            content_type=upload.content_type,
             path=os.path.join("uploads", hash),
         )
     except ValidationError:
         raise HTTPException(status_code=400, detail="Invalid document.")
 
-    # Add the document object to the database
+    # Add the document to the database and queue it for ingestion
     try:
-        session.add(document)
-        session.commit()
-        session.refresh(document)
-
-        # Save the file in the background
-        background_tasks.add_task(helpers.save_file, document.path, content)
-        background_tasks.add_task(llama_index.add_document_to_index, document.id)
+        await ingestion.enqueue(document)
     except IntegrityError:
         pass
 
@@ -115,46 +143,92 @@ async def upload(
         }
     }
 
+@app.get("/documents/{document_id}/status")
+async def document_status(document_id: str, session: SessionDep):
+    # Get the ingestion job of the document
+    job = await session.get(Jobs, document_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Document not found.")
+
+    return {
+        "success": True,
+        "data": {
+            "job": job
+        }
+    }
+
+async def check_ingested(session: AsyncSession, document_id: str):
+    # Only ingested documents can be queried
+    job = await session.get(Jobs, document_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    if job.state != JobState.PERSISTED:
+        raise HTTPException(status_code=409, detail="Document is not ingested yet.")
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str, session: SessionDep):
+    document = await session.get(Documents, document_id)
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    if ingestion.is_running(document_id):
+        raise HTTPException(status_code=409, detail="Document is being ingested.")
+
+    await ingestion.delete(document)
+
+    # Reclaim the space in the background
+    ingestion.schedule_compaction()
+    return {"success": True}
+
+@app.post("/documents/{document_id}/batch-query")
+async def batch_query(document_id: str, query: BatchQuery, session: SessionDep):
+    await check_ingested(session, document_id)
+    if not query.questions:
+        raise HTTPException(status_code=400, detail="No questions provided.")
+
+    # Stream each answer as a JSON line once it is ready
+    async def lines():
+        async for result in qa.batch_query(document_id, query.questions):
+            yield json.dumps(result) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/documents/{document_id}/chat")
+async def chat(document_id: str, query: ChatQuery, session: SessionDep):
+    await check_ingested(session, document_id)
+    if not query.question.strip():
+        raise HTTPException(status_code=400, detail="No question provided.")
+    session_id = query.session_id or uuid.uuid4().hex
+
+    # Stream the tokens and citations as server-sent events
+    async def events():
+        try:
+            async for event, data in qa.chat(document_id, session_id, query.question):
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Session-Id": session_id},
+    )
+
 @app.post("/connect")
 async def rtvi_connect(
     request: Request,
     background_tasks: BackgroundTasks,
 ) -> Dict[Any, Any]:
-    # Get the room URL and token
-    room_url, token = await manager.create_room_and_token()
-
-    # Spawn a new bot for the room
     try:
-        proc = subprocess.Popen(
-            [f"python3 -m lib.bots.default -u {room_url} -t {token} -d {manager.document.id}"],
-            shell=True,
-            bufsize=1,
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-        )
-        # Add the process to the list
-        manager.add_process(proc.pid, proc)
+        # Wait until there is room for another bot
+        async with manager.admit():
+            # Get the room URL and token
+            room_url, token = await manager.create_room_and_token()
+
+            # Hand the room over to a bot
+            await manager.start_bot(room_url, token, manager.document.id)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail="Failed to process!")
 
     # Return the room URL and token
     return {"room_url": room_url, "token": token}
-
-# For testing purposes
-# Use this part as a CLI tool
-if __name__ == "__main__":
-    import shutil
-    import argparse
-    parser = argparse.ArgumentParser(description="Codex CLI")
-    parser.add_argument("command", type=str, help="The command to run", choices=["reset"])
-
-    args = parser.parse_args()
-
-    # Handle args
-    match args.command:
-        case "reset":
-            print("Resetting...")
-            os.remove("codex.db")
-            shutil.rmtree("uploads", ignore_errors=True)
-            shutil.rmtree("storage", ignore_errors=True)
-            print("Done!")
\ No newline at end of file
@@ -0,0 +1,48 @@
+from llama_index.core.llms import MockLLM
+from llama_index.core.schema import MetadataMode, NodeWithScore, TextNode
+
+from lib.engines.citated_query_engine import CitatedQueryEngine, CITATION_CHUNKS_KEY, CITATION_OF_KEY
+from lib.parser import HIDDEN_METADATA_KEYS
+
+def create_engine() -> CitatedQueryEngine:
+    # Only the citation nodes are tested, so nothing is retrieved or generated
+    return CitatedQueryEngine(retriever=None, llm=MockLLM())
+
+def create_node() -> NodeWithScore:
+    return NodeWithScore(
+        node=TextNode(
+            id_="doc-1-0",
+            text="The sky is red in the evening. Water is wet when the sky is red.",
+            metadata={
+                "id_": "doc",
+                "page": 1,
+                "offset": 0,
+                CITATION_CHUNKS_KEY: ["The sky is red in the evening.", "Water is wet when the sky is red."],
+            },
+            excluded_embed_metadata_keys=HIDDEN_METADATA_KEYS + ["page"],
+            excluded_llm_metadata_keys=HIDDEN_METADATA_KEYS,
+        ),
+        score=0.5,
+    )
+
+def test_citation_nodes_hide_parent_metadata_from_llm():
+    nodes = create_engine()._create_citation_nodes([create_node()])
+    assert len(nodes) == 2
+
+    content = nodes[0].node.get_content(MetadataMode.LLM)
+    # Recent llama_index versions strip the trailing newline of the template
+    assert content.rstrip() == "page: 1\n\nSource 1:\nThe sky is red in the evening."
+    for key in ["doc-1-0", "offset", CITATION_OF_KEY, CITATION_CHUNKS_KEY]:
+        assert key not in content
+
+def test_citation_nodes_hide_parent_metadata_from_embeddings():
+    nodes = create_engine()._create_citation_nodes([create_node()])
+
+    content = nodes[1].node.get_content(MetadataMode.EMBED)
+    assert content == "Source 2:\nWater is wet when the sky is red.\n"
+    assert nodes[1].node.metadata[CITATION_OF_KEY] == "doc-1-0"
+
+def test_citation_nodes_are_not_split_again():
+    engine = create_engine()
+    nodes = engine._create_citation_nodes([create_node()])
+    assert engine._create_citation_nodes(nodes) is nodes
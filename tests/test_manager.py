@@ -0,0 +1,165 @@
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import pytest
+from aiohttp.test_utils import TestServer
+
+from lib.fake_daily import FakeDaily
+from lib.manager import ConnectionManager, Overloaded, ROOM_EXPIRY
+
+@pytest.fixture
+def settings(tmp_path, monkeypatch):
+    # The manager reads config.json from the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("MIN_AVAILABLE_MEMORY", "0")
+
+    def apply(**values):
+        for key, value in values.items():
+            monkeypatch.setenv(key, str(value))
+    return apply
+
+@asynccontextmanager
+async def running_manager(daily: FakeDaily) -> AsyncIterator[ConnectionManager]:
+    async with TestServer(daily.create_app()) as server:
+        with open("config.json", "w") as f:
+            json.dump({"DAILY_API_KEY": "test", "DAILY_API_URL": str(server.make_url("")).rstrip("/")}, f)
+
+        manager = ConnectionManager()
+
+        # No bot workers are needed for the rooms
+        manager.pool.start = lambda: None
+        await manager.start()
+        try:
+            yield manager
+        finally:
+            await manager.close()
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        await asyncio.sleep(0.01)
+
+def test_fills_room_pool(settings):
+    settings(ROOM_POOL_SIZE=2)
+    daily = FakeDaily()
+
+    async def run():
+        async with running_manager(daily) as manager:
+            await wait_for(lambda: len(manager.rooms) == 2)
+            assert {url for url, _, _ in manager.rooms} == {room["url"] for room in daily.rooms.values()}
+            assert all(exp - time.time() > manager.room_min_ttl for _, _, exp in manager.rooms)
+    asyncio.run(run())
+
+def test_takes_pooled_room_and_refills(settings):
+    settings(ROOM_POOL_SIZE=2)
+    daily = FakeDaily()
+
+    async def run():
+        async with running_manager(daily) as manager:
+            await wait_for(lambda: len(manager.rooms) == 2)
+            pooled = manager.rooms[0]
+
+            room_url, token = await manager.create_room_and_token()
+            assert (room_url, token) == pooled[:2]
+            assert token in daily.tokens
+
+            # The taken room is replaced in the background
+            await wait_for(lambda: len(manager.rooms) == 2)
+            assert len(daily.rooms) == 3
+            assert room_url not in {url for url, _, _ in manager.rooms}
+    asyncio.run(run())
+
+def test_refreshes_rooms_close_to_expiry(settings):
+    settings(ROOM_POOL_SIZE=2, ROOM_MIN_TTL=ROOM_EXPIRY - 60)
+    daily = FakeDaily()
+
+    async def run():
+        async with running_manager(daily) as manager:
+            await wait_for(lambda: len(manager.rooms) == 2)
+            stale = {url for url, _, _ in manager.rooms}
+
+            # Age the pooled rooms past the minimum TTL
+            manager.rooms = type(manager.rooms)(
+                (url, token, exp - 120) for url, token, exp in manager.rooms
+            )
+            manager.refill_event.set()
+
+            await wait_for(lambda: len(manager.rooms) == 2 and not stale & {url for url, _, _ in manager.rooms})
+            assert len(daily.rooms) == 4
+    asyncio.run(run())
+
+def test_skips_stale_room_when_taking(settings):
+    settings(ROOM_POOL_SIZE=0)
+    daily = FakeDaily()
+
+    async def run():
+        async with running_manager(daily) as manager:
+            manager.rooms.append(("https://fake.daily.co/stale", "stale", time.time() + 10))
+
+            room_url, token = await manager.create_room_and_token()
+            assert room_url != "https://fake.daily.co/stale"
+            assert token in daily.tokens
+            assert not manager.rooms
+    asyncio.run(run())
+
+def test_creates_room_when_pool_is_exhausted(settings):
+    settings(ROOM_POOL_SIZE=1)
+    daily = FakeDaily()
+
+    async def run():
+        async with running_manager(daily) as manager:
+            await wait_for(lambda: len(manager.rooms) == 1)
+
+            # Take more rooms than the pool holds, faster than it refills
+            rooms = await asyncio.gather(*[manager.create_room_and_token() for _ in range(3)])
+            assert len({url for url, _ in rooms}) == 3
+            assert all(token in daily.tokens for _, token in rooms)
+    asyncio.run(run())
+
+def test_rejects_connect_after_queue_timeout(settings):
+    settings(ROOM_POOL_SIZE=0, MAX_BOTS=1, BOT_QUEUE_TIMEOUT=0.2)
+
+    async def run():
+        async with running_manager(FakeDaily()) as manager:
+            async with manager.admit():
+                started = time.monotonic()
+                with pytest.raises(Overloaded) as error:
+                    async with manager.admit():
+                        pass
+                assert time.monotonic() - started >= 0.2
+
+            # The route answers 503 with this as its Retry-After header
+            assert error.value.retry_after == 1
+            assert manager.reserved == 0
+    asyncio.run(run())
+
+def test_admits_queued_connect_when_slot_frees(settings):
+    settings(ROOM_POOL_SIZE=0, MAX_BOTS=1, BOT_QUEUE_TIMEOUT=5)
+
+    async def run():
+        async with running_manager(FakeDaily()) as manager:
+            release = asyncio.Event()
+
+            async def hold():
+                async with manager.admit():
+                    await release.wait()
+
+            async def queued():
+                async with manager.admit():
+                    return manager.reserved
+
+            holder = asyncio.create_task(hold())
+            await wait_for(lambda: manager.reserved == 1)
+            waiter = asyncio.create_task(queued())
+            await asyncio.sleep(0.1)
+            assert not waiter.done()
+
+            release.set()
+            assert await asyncio.wait_for(waiter, timeout=2) == 1
+            await holder
+    asyncio.run(run())
@@ -0,0 +1,26 @@
+from lib.text_filters import CitationFilter
+
+def test_removes_markers_split_across_chunks():
+    text_filter = CitationFilter()
+    text_filter.start_response()
+    assert text_filter.filter("Water is wet [") == "Water is wet "
+    assert text_filter.filter("2] when the sky is red.") == " when the sky is red."
+
+def test_flushes_partial_marker_at_end_of_response():
+    text_filter = CitationFilter()
+    text_filter.start_response()
+    assert text_filter.filter("See page [12") == "See page "
+    text_filter.end_response()
+    assert text_filter.filter(" and more") == "[12 and more"
+
+    # Nothing is left over for the next response
+    text_filter.start_response()
+    assert text_filter.filter("Hello.") == "Hello."
+
+def test_drops_partial_marker_after_interruption():
+    text_filter = CitationFilter()
+    text_filter.start_response()
+    assert text_filter.filter("See page [1") == "See page "
+    text_filter.handle_interruption()
+    text_filter.reset_interruption()
+    assert text_filter.filter("Hello.") == "Hello."